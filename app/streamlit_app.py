@@ -1,21 +1,33 @@
 import os
-from hashlib import blake2b
-from tempfile import NamedTemporaryFile
-import replicate
+import time
 
 import dotenv
-from grobid_client.grobid_client import GrobidClient
-import replicate.account
+import fitz
 from streamlit_pdf_viewer import pdf_viewer
-from openai import OpenAI
 
+from grobid.annotations import AnnotationStore
 from grobid.grobid_processor import GrobidProcessor
+from grobid.pool import GrobidPool
+from llm.backends import BACKENDS, ReplicateBackend, TimedStream
+from llm.memory import ConversationMemory, format_message, get_token_counter
+from llm.prefetch import Prefetcher
+from llm.response_cache import ResponseCache
+from llm.retrieval import ChunkIndex, build_prompt, get_embedder
+from src.cache import DiskCache
+from src.document_store import DocumentStore
+from src.ocr import OCRFallback
+from src.page_window import PageWindow
+from src.tracing import tracer
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import streamlit as st
 
 dotenv.load_dotenv(override=True)
 
+# the spans of this rerun, see the "Show timings" panel
+trace = tracer.start_trace("rerun")
+
 
 st.set_page_config(
     page_title="Paperx with Llama2 ChatBot",
@@ -46,21 +58,12 @@ if "git_rev" not in st.session_state:
 if "uploaded" not in st.session_state:
     st.session_state["uploaded"] = False
 
-if "binary" not in st.session_state:
-    st.session_state["binary"] = None
-
-if "annotations" not in st.session_state:
-    st.session_state["annotations"] = []
-
 if "pages" not in st.session_state:
     st.session_state["pages"] = None
 
 if "page_selection" not in st.session_state:
     st.session_state["page_selection"] = []
 
-if "segments" not in st.session_state.keys():
-    st.session_state["segments"] = []
-
 if "messages" not in st.session_state.keys():
     st.session_state["messages"] = [
         {
@@ -73,12 +76,21 @@ if "llama" not in st.session_state:
     st.session_state["llama"] = None
 
 
+SYSTEM_PROMPT = "You are a helpful assistant. You do not respond as 'User' or pretend to be 'User'. You only respond once as 'Assistant'."
+EXPLAIN_PROMPT = "give technical explanation about this topic: \n{label}"
+SEGMENTS_PER_PAGE = 25
+
+
 ### ---------- Methods ---------- ###
 def new_file():
+    if "prefetcher" in st.session_state:
+        st.session_state["prefetcher"].cancel()
     st.session_state["doc_id"] = None
     st.session_state["uploaded"] = True
-    st.session_state["annotations"] = []
-    st.session_state["binary"] = None
+    # the session only keeps the hash, the document is in the store
+    st.session_state["hash"] = None
+    st.session_state["pages"] = None
+    st.session_state["prefetch_pending"] = False
 
 
 # def init_grobid():
@@ -93,65 +105,334 @@ def new_file():
 
 @st.cache_resource
 def init_grobid():
-    try:
-        # Initialize Grobid client or connection
-        grobid_client = GrobidClient()  # Replace with actual initialization code
-        grobid_processor = GrobidProcessor(grobid_client)
-        if grobid_processor:
-            print("Grobid client initialized successfully.")
-            return grobid_processor
+    # not caught: a failure is not cached and the next rerun tries again
+    grobid_pool = GrobidPool.from_config(
+        os.environ.get("GROBID_CONFIG", "./config.json"),
+        servers=os.environ.get("GROBID_SERVERS"),
+    )
+    grobid_cache = DiskCache(
+        os.environ.get("GROBID_CACHE_PATH", "./.cache/grobid.sqlite"),
+        max_bytes=int(os.environ.get("GROBID_CACHE_MAX_MB", 1024)) * 1024**2,
+    )
+    ocr = None
+    if os.environ.get("OCR_FALLBACK", "1") == "1":
+        if OCRFallback.is_available():
+            ocr = OCRFallback(cache=grobid_cache)
         else:
-            print("Failed to initialize Grobid client.")
-            return None
+            print("Tesseract not found, OCR fallback disabled.")
+    print("Grobid client initialized successfully.")
+    return GrobidProcessor(grobid_pool, cache=grobid_cache, ocr=ocr)
+
+
+def get_grobid():
+    try:
+        return init_grobid()
     except Exception as e:
         print(f"Exception occurred: {e}")
         return None
 
 
 @st.cache_resource
-def get_llama():
+def get_backend(name, *args):
+    # one instance, and pool of connections, per configuration
     try:
-        client = OpenAI(
-            base_url="http://localhost:8080/v1",
-            api_key="tom",
-        )
-        return client
-    except:
+        return BACKENDS[name](*args)
+    except Exception as e:
+        print(f"Exception occurred: {e}")
+        return None
+
+
+@st.cache_resource
+def init_document_store():
+    return DocumentStore(
+        os.environ.get("DOCUMENT_STORE_PATH", "./.cache/documents"),
+        max_bytes=int(os.environ.get("DOCUMENT_STORE_MAX_MB", 4096)) * 1024**2,
+    )
+
+
+@st.cache_resource(max_entries=16)
+def get_annotations(doc_hash):
+    # memory mapped, one copy for all the sessions on the document
+    store = init_document_store().get_annotations(doc_hash)
+    store.build_index()
+    return store
+
+
+@st.cache_resource
+def init_full_text_executor():
+    return ThreadPoolExecutor(max_workers=int(os.environ.get("FULL_TEXT_WORKERS", 2)))
+
+
+@st.cache_resource
+def get_progress():
+    # full texts on their way, by hash, shared by the sessions
+    return {}
+
+
+def start_full_text(doc_hash, spool_path, grobid_processor, chunk_pages):
+    """Process the first page now and the full text in the background.
+
+    Return the page count, or None when GROBID cannot read the first page.
+    Until the document is in the store, ``get_progress()[doc_hash]`` holds
+    the annotations so far; the entry goes as soon as the job is over.
+    """
+    with fitz.open(spool_path) as doc:
+        page_count = doc.page_count
+    progress = get_progress()
+    if doc_hash in progress:
+        # another session is on it
+        os.unlink(spool_path)
+        return page_count
+    chunk_pages = chunk_pages or None
+    if grobid_processor.cache is not None and grobid_processor.load_result(
+        grobid_processor.cache_key(doc_hash, chunk_pages=chunk_pages)
+    ):
+        # processed before, no header to wait for
+        if init_document_store().get_or_process(
+            doc_hash, spool_path, grobid_processor, move=True, chunk_pages=chunk_pages
+        ):
+            return page_count
+        return None
+    header = grobid_processor.process_header(spool_path, file_hash=doc_hash)
+    if header is None:
+        os.unlink(spool_path)
         return None
+    # a second name for the spooled file, which is moved into the store
+    view_path = f"{spool_path}.view"
+    os.link(spool_path, view_path)
+    state = {
+        "header": header["coordinates"],
+        "coordinates": [],
+        "page": 0,
+        "page_count": page_count,
+        "path": view_path,
+    }
+
+    def on_chunk(coordinates, page, page_count):
+        state["coordinates"] = list(coordinates)
+        state["page"] = page
+
+    def run():
+        try:
+            return init_document_store().get_or_process(
+                doc_hash,
+                spool_path,
+                grobid_processor,
+                move=True,
+                chunk_pages=chunk_pages,
+                on_chunk=on_chunk,
+            )
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+            return False
+        finally:
+            progress.pop(doc_hash, None)
+            os.unlink(view_path)
+
+    progress[doc_hash] = state
+    init_full_text_executor().submit(run)
+    return page_count
 
 
-def get_file_hash(fname):
-    hash_md5 = blake2b()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+def is_complete():
+    return bool(st.session_state["hash"]) and (
+        st.session_state["hash"] in init_document_store()
+    )
+
+
+def get_document_annotations():
+    doc_hash = st.session_state["hash"]
+    if not doc_hash:
+        return AnnotationStore.from_dicts([])
+    if doc_hash in init_document_store():
+        return get_annotations(doc_hash)
+    state = get_progress().get(doc_hash)
+    if state is None:
+        return AnnotationStore.from_dicts([])
+    # the first range of the full text covers the header
+    return AnnotationStore.from_dicts(
+        state["coordinates"] if state["page"] else state["header"]
+    )
+
+
+def get_document_path():
+    doc_hash = st.session_state["hash"]
+    state = get_progress().get(doc_hash)
+    if doc_hash in init_document_store() or state is None:
+        # the job is over: the document was moved into the store
+        return init_document_store().get_pdf_path(doc_hash)
+    return state["path"]
+
+
+@st.cache_resource(max_entries=16)
+def get_page_window(doc_hash, _binary):
+    return PageWindow(_binary)
+
+
+@st.cache_resource
+def init_embedder():
+    # hashing embeddings unless a local GGUF embedding model is configured
+    return get_embedder(os.environ.get("EMBEDDING_MODEL_PATH"))
+
+
+@st.cache_resource(max_entries=16)
+def get_chunk_index(doc_hash, _store):
+    return ChunkIndex.load_or_build(
+        os.environ.get("INDEX_DIR", "./.cache/index"),
+        doc_hash,
+        _store,
+        init_embedder(),
+    )
+
+
+@st.cache_resource(max_entries=32)
+def get_segments(doc_hash, types):
+    # derived once per document and set of types, not on every rerun
+    return init_document_store().get_segments(doc_hash, types)
+
+
+@st.cache_resource(max_entries=64)
+def search_segments(doc_hash, types, query):
+    segments = get_segments(doc_hash, types)
+    if not query:
+        return segments
+    query = query.lower()
+    return [segment for segment in segments if query in segment[1].lower()]
+
+
+@st.cache_resource
+def init_token_counter():
+    return get_token_counter(os.environ.get("TOKENIZER_MODEL_PATH"))
+
+
+def summarize_turns(model, summary, messages):
+    turns = "\n".join(format_message(message) for message in messages)
+    prompt = (
+        "Update the summary with the new lines of the conversation, "
+        f"in a few sentences.\nSummary: {summary}\nNew lines:\n{turns}\n"
+        "Updated summary: "
+    )
+    # an answer preempts it, the turns are then folded extractively
+    return "".join(
+        model.generate_background(prompt, {"temperature": 0.1, "max_length": 96})
+    )
+
+
+@st.cache_resource
+def init_summary_executor():
+    # the folds of all the sessions, never in the way of an answer
+    return ThreadPoolExecutor(max_workers=int(os.environ.get("SUMMARY_WORKERS", 1)))
+
+
+def get_memory():
+    # the summaries go to the backend of the run, see fold_history
+    if "memory" not in st.session_state:
+        st.session_state["memory"] = ConversationMemory(init_token_counter())
+    return st.session_state["memory"]
+
+
+@st.cache_resource
+def init_response_cache():
+    return ResponseCache(
+        DiskCache(
+            os.environ.get("LLM_CACHE_PATH", "./.cache/llm.sqlite"),
+            max_bytes=int(os.environ.get("LLM_CACHE_MAX_MB", 64)) * 1024**2,
+            ttl=float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600)),
+        ),
+        max_temperature=float(os.environ.get("LLM_CACHE_MAX_TEMPERATURE", 0.3)),
+    )
+
+
+def fold_history():
+    """Fold the turns out of the history's window into its summary, in the
+    background once the answer is out."""
+    init_summary_executor().submit(
+        get_memory().fold,
+        list(st.session_state.messages),
+        partial(summarize_turns, backend),
+    )
 
 
 def clear_chat_history():
     st.session_state.messages = [
         {"role": "assistant", "content": "How may I assist you today?"}
     ]
+    get_memory().reset()
+
+
+def get_params():
+    return {
+        "temperature": temperature,
+        "top_p": top_p,
+        "max_length": max_length,
+        "repetition_penalty": 1,
+    }
+
+
+def generate_llama2_response(prompt_input, use_history=True):
+    passages = []
+    # the index is kept, it is built on the full text only
+    if is_complete():
+        store = get_document_annotations()
+        index = get_chunk_index(st.session_state["hash"], store)
+        passages = index.search(prompt_input, init_embedder(), k=top_k)
+    summary, history = "", []
+    if use_history:
+        memory = get_memory()
+        memory.budget = history_tokens
+        # the last message is the prompt itself
+        summary, history = memory.get_context(st.session_state.messages[:-1])
+    prompt = build_prompt(SYSTEM_PROMPT, prompt_input, passages, history, summary)
+    params = get_params()
+    return init_response_cache().stream(
+        backend.model_id, params, prompt, lambda: backend.generate(prompt, params)
+    )
 
 
-def generate_llama2_response(prompt_input):
-    string_dialogue = "You are a helpful assistant. You do not respond as 'User' or pretend to be 'User'. You only respond once as 'Assistant'."
-    for dict_message in st.session_state.messages:
-        if dict_message["role"] == "user":
-            string_dialogue += "User: " + dict_message["content"] + "\n\n"
-        else:
-            string_dialogue += "Assistant: " + dict_message["content"] + "\n\n"
-    output = replicate.run(
-        "a16z-infra/llama13b-v2-chat:df7690f1994d94e96ad9d568eac121aecf50684a0b0963b25a41cc40061269e5",
-        input={
-            "prompt": f"{string_dialogue} {prompt_input} Assistant: ",
-            "temperature": temperature,
-            "top_p": top_p,
-            "max_length": max_length,
-            "repetition_penalty": 1,
-        },
+@st.cache_resource
+def init_prefetch_executor():
+    # shared by all the sessions, bounds the concurrent requests
+    return ThreadPoolExecutor(max_workers=int(os.environ.get("PREFETCH_WORKERS", 2)))
+
+
+def prefetch_explanations():
+    """Ask for the explanations of the title and the heads in the background,
+    the answers go to the response cache shared with the buttons."""
+    store = get_document_annotations()
+    response_cache = init_response_cache()
+    params = get_params()
+    if not is_complete() or not response_cache.is_cacheable(params):
+        return
+    # everything the workers need, they have no access to the session
+    index = get_chunk_index(st.session_state["hash"], store)
+    embedder = init_embedder()
+    model = backend
+    k = top_k
+
+    def complete(prompt_input):
+        passages = index.search(prompt_input, embedder, k=k)
+        prompt = build_prompt(SYSTEM_PROMPT, prompt_input, passages, [])
+        return response_cache.stream(
+            model.model_id,
+            params,
+            prompt,
+            lambda: model.generate_background(prompt, params),
+        )
+
+    labels = []
+    types = [type for type in ("title", "head") if type in store.types]
+    for segment in store.to_dicts(store.select(types)):
+        label = str(segment["text"]).strip()
+        if len(label) > 5 and label not in labels:
+            labels.append(label)
+    if "prefetcher" not in st.session_state:
+        st.session_state["prefetcher"] = Prefetcher(
+            init_prefetch_executor(),
+            max_requests=int(os.environ.get("PREFETCH_MAX_REQUESTS", 8)),
+        )
+    st.session_state["prefetcher"].start(
+        [EXPLAIN_PROMPT.format(label=label) for label in labels], complete
     )
-    return output
 
 
 def write_prompt(prompt):
@@ -160,48 +441,89 @@ def write_prompt(prompt):
         st.write(prompt)
 
 
-def llama_answer(prompt):
+def llama_answer(use_history=True):
+    """Answer the last message unless it is the assistant's; a message left
+    without an answer, e.g. by an error, is answered on the next rerun."""
+    if backend is None:
+        return
     if st.session_state.messages[-1]["role"] != "assistant":
+        prompt = st.session_state.messages[-1]["content"]
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = generate_llama2_response(prompt)
+            with st.spinner("Thinking..."), tracer.span(
+                "llm.answer", backend=backend.name
+            ) as span:
+                response = TimedStream(generate_llama2_response(prompt, use_history))
                 placeholder = st.empty()
                 full_response = ""
                 for item in response:
                     full_response += item
                     placeholder.markdown(full_response)
                 placeholder.markdown(full_response)
+                span.set(
+                    ttft=response.ttft,
+                    chunks=response.count,
+                    bytes=len(full_response.encode("utf-8")),
+                )
+            st.caption(f"{backend.name}: {response.report()}")
         message = {"role": "assistant", "content": full_response}
         st.session_state.messages.append(message)
+        if use_history:
+            fold_history()
 
 
 def llama_write_answer(prompt):
     write_prompt(prompt)
-    llama_answer(prompt)
+    # the explanation of a segment does not depend on the chat, so the
+    # answer can be shared with any session on the same paper
+    llama_answer(use_history=False)
 
 
 ### ---------- Sidebar ---------- ###
 with st.sidebar:
     ### ---------- Setting up Llama parameters ---------- ###
     st.markdown("# 🦙💬 Llama 2 Chatbot")
-    if os.environ.get("REPLICATE_API_TOKEN"):
-        st.success("API key already provided!", icon="✅")
-        replicate_api = os.environ.get("REPLICATE_API_TOKEN")
-    else:
-        replicate_api = st.text_input("Enter Replicate API token:", type="password")
-        if not (replicate_api.startswith("r8_") and len(replicate_api) == 40):
-            st.warning("Please enter your credentials!", icon="⚠️")
-        else:
-            st.success("Proceed to entering your prompt message!", icon="👉")
-    os.environ["REPLICATE_API_TOKEN"] = replicate_api
     st.markdown("## Models and parameters")
-    selected_model = st.sidebar.selectbox(
-        "Choose a Llama2 model", ["Llama2-7B", "Llama2-13B"], key="selected_model"
-    )
-    if selected_model == "Llama2-7B":
-        llm = "a16z-infra/llama7b-v2-chat:4f0a4744c7295c024a1de15e1a63c880d3da035fa1f49bfd344fe076074c8eea"
-    elif selected_model == "Llama2-13B":
-        llm = "a16z-infra/llama13b-v2-chat:df7690f1994d94e96ad9d568eac121aecf50684a0b0963b25a41cc40061269e5"
+    backend_name = st.sidebar.selectbox("Backend", list(BACKENDS), key="backend")
+    if backend_name == ReplicateBackend.name:
+        if os.environ.get("REPLICATE_API_TOKEN"):
+            st.success("API key already provided!", icon="✅")
+            replicate_api = os.environ.get("REPLICATE_API_TOKEN")
+        else:
+            replicate_api = st.text_input("Enter Replicate API token:", type="password")
+            if not (replicate_api.startswith("r8_") and len(replicate_api) == 40):
+                st.warning("Please enter your credentials!", icon="⚠️")
+            else:
+                st.success("Proceed to entering your prompt message!", icon="👉")
+        os.environ["REPLICATE_API_TOKEN"] = replicate_api
+        selected_model = st.sidebar.selectbox(
+            "Choose a Llama2 model", ["Llama2-7B", "Llama2-13B"], key="selected_model"
+        )
+        if selected_model == "Llama2-7B":
+            llm = "a16z-infra/llama7b-v2-chat:4f0a4744c7295c024a1de15e1a63c880d3da035fa1f49bfd344fe076074c8eea"
+        elif selected_model == "Llama2-13B":
+            llm = "a16z-infra/llama13b-v2-chat:df7690f1994d94e96ad9d568eac121aecf50684a0b0963b25a41cc40061269e5"
+        backend = get_backend(backend_name, llm, replicate_api) if replicate_api else None
+    elif backend_name == "OpenAI-compatible":
+        base_url = st.text_input(
+            "Server URL",
+            os.environ.get("OPENAI_BASE_URL", "http://localhost:8080/v1"),
+        )
+        model_name = st.text_input(
+            "Model", os.environ.get("OPENAI_MODEL", "llama-2-7b-chat")
+        )
+        backend = get_backend(
+            backend_name, base_url, model_name, os.environ.get("OPENAI_API_KEY")
+        )
+    else:
+        model_path = st.text_input(
+            "Model file",
+            os.environ.get(
+                "LLAMA_MODEL_PATH", "./models/llama-2-7b-chat.Q4_K_M.gguf"
+            ),
+        )
+        backend = get_backend(backend_name, model_path)
+    if backend is None:
+        st.warning("The model is not available with these settings.", icon="⚠️")
     temperature = st.sidebar.slider(
         "temperature", min_value=0.01, max_value=5.0, value=0.1, step=0.01
     )
@@ -211,18 +533,47 @@ with st.sidebar:
     max_length = st.sidebar.slider(
         "max_length", min_value=32, max_value=128, value=120, step=8
     )
+    top_k = st.sidebar.slider(
+        "Passages from the paper", min_value=0, max_value=8, value=3, step=1
+    )
+    history_tokens = st.sidebar.slider(
+        "Tokens of history", min_value=0, max_value=1024, value=192, step=32
+    )
     st.button("Clear Chat History", on_click=clear_chat_history)
+    prefetch = st.toggle(
+        "Prefetch explanations",
+        value=False,
+        help="Ask for the explanations of the title and the heads right after the upload, so the first clicks answer at once.",
+    )
 
     st.divider()
     ### ---------- Setting up Grobid parameters ---------- ###
     st.markdown("# :book: GROBID Editor")
-    if init_grobid():
-        st.success("GROBID server is up and running!", icon="✅")
+    grobid_processor = get_grobid()
+    available = grobid_processor.grobid_client.available() if grobid_processor else []
+    if available:
+        servers = len(grobid_processor.grobid_client.endpoints)
+        st.success(
+            f"GROBID is up and running on {len(available)} of {servers} servers!",
+            icon="✅",
+        )
     else:
         st.warning(
             "GROBID server does not appear up and running, the connection to the server failed!",
             icon="⚠️",
         )
+    header_first = st.toggle(
+        "Header first",
+        value=os.environ.get("HEADER_FIRST", "1") == "1",
+        help="Show the title, authors and affiliations at once, the full text follows in the background.",
+    )
+    chunk_pages = st.number_input(
+        "Pages per full text request",
+        min_value=0,
+        value=int(os.environ.get("GROBID_CHUNK_PAGES", 0)),
+        help="The full text fills in range by range, 0 asks for the whole document at once.",
+        disabled=not header_first,
+    )
     st.markdown("## Highlights controllers")
     highlight_title = st.toggle(
         "Title", value=True, disabled=not st.session_state["uploaded"]
@@ -267,6 +618,18 @@ with st.sidebar:
     pages_vertical_spacing = st.slider(
         label="Pages vertical spacing", min_value=0, max_value=10, value=2
     )
+    lazy_rendering = st.toggle(
+        "Send only the displayed pages",
+        value=True,
+        help="The PDF is cut down to the selected pages, or to a window of pages when none is selected.",
+    )
+    window_size = st.slider(
+        label="Pages per window",
+        min_value=1,
+        max_value=20,
+        value=5,
+        disabled=not lazy_rendering,
+    )
 
     st.header("Height and width")
     width = st.slider(label="PDF width", min_value=100, max_value=1000, value=700)
@@ -285,6 +648,24 @@ with st.sidebar:
             key=1,
         )
 
+    if tracer.enabled and st.toggle(
+        "Show timings", value=False, help="Where the time went in the last run."
+    ):
+        st.dataframe(
+            [
+                {
+                    "stage": "  " * span["depth"] + span["name"],
+                    "ms": round(span["duration"] * 1000, 1),
+                    "KiB": round(span["bytes"] / 1024, 1) if span.get("bytes") else None,
+                    "memory MiB": round(span["memory"] / 1024**2, 1)
+                    if span.get("memory") is not None
+                    else None,
+                }
+                for span in st.session_state.get("last_trace", [])
+            ],
+            hide_index=True,
+        )
+
     st.header("Documentation")
     st.markdown("https://github.com/ifatwme/paperx")
     st.markdown(
@@ -318,156 +699,191 @@ with right_column:
     )
 
     if uploaded_file:
-        if not st.session_state["binary"]:
+        if not st.session_state["hash"]:
             with st.spinner("Reading file, calling Grobid..."):
-                binary = uploaded_file.getvalue()
-                tmp_file = NamedTemporaryFile()
-                tmp_file.write(bytearray(binary))
-                st.session_state["binary"] = binary
-                grobid_client = init_grobid()
-                if grobid_client:  # Check if grobid_client is not None
-                    annotations, pages = grobid_client.process_structure(tmp_file.name)
-                else:
+                document_store = init_document_store()
+                # one copy on disk, hashed while written, moved into the store
+                uploaded_file.seek(0)
+                doc_hash, spool_path = document_store.spool(uploaded_file)
+                grobid_client = get_grobid()
+                if doc_hash not in document_store and not grobid_client:
+                    os.unlink(spool_path)
                     st.error(
                         "Failed to initialize Grobid. Please check the server connection and try again."
                     )
-
-                st.session_state["annotations"] = (
-                    annotations
-                    if not st.session_state["annotations"]
-                    else st.session_state["annotations"]
-                )
-                st.session_state["pages"] = (
-                    pages
-                    if not st.session_state["pages"]
-                    else st.session_state["pages"]
+                elif header_first and doc_hash not in document_store:
+                    page_count = start_full_text(
+                        doc_hash, spool_path, grobid_client, chunk_pages
+                    )
+                    if page_count is not None:
+                        st.session_state["hash"] = doc_hash
+                        st.session_state["pages"] = page_count
+                        st.session_state["prefetch_pending"] = prefetch
+                    else:
+                        st.error("Grobid could not process the document.")
+                elif document_store.get_or_process(
+                    doc_hash, spool_path, grobid_client, move=True
+                ):
+                    st.session_state["hash"] = doc_hash
+                    st.session_state["pages"] = len(
+                        document_store.get_meta(doc_hash)["pages"]
+                    )
+                    st.session_state["prefetch_pending"] = prefetch
+                else:
+                    st.error("Grobid could not process the document.")
+
+        in_progress = False
+        if st.session_state["hash"] and not is_complete():
+            state = get_progress().get(st.session_state["hash"])
+            if state is None:
+                st.error("Grobid could not process the full text of the document.")
+                st.session_state["hash"] = None
+            else:
+                in_progress = True
+                st.info(
+                    f"Full text on its way: {state['page']} of "
+                    f"{state['page_count']} pages",
+                    icon="⏳",
                 )
+        if st.session_state.get("prefetch_pending") and is_complete():
+            st.session_state["prefetch_pending"] = False
+            if backend is not None:
+                prefetch_explanations()
 
         if st.session_state["pages"]:
             st.session_state["page_selection"] = placeholder.multiselect(
                 "Select pages to display",
-                options=list(range(1, st.session_state["pages"])),
+                options=list(range(1, st.session_state["pages"] + 1)),
                 default=[],
                 help="The page number considered is the PDF number and not the document page number.",
                 disabled=not st.session_state["pages"],
                 key=2,
             )
 
-        with st.spinner("Rendering PDF document"):
-            annotations = st.session_state["annotations"]
-
-            titles_list = [
-                "s",
-                "p",
-                "title",
-                "head",
-                "biblStruct",
-                "note",
-                "ref",
-                "formula",
-                "persName",
-                "figure",
-            ]
-
-            if not highlight_sentences:
-                annotations = list(filter(lambda a: a["type"] != "s", annotations))
-
-            if not highlight_paragraphs:
-                annotations = list(filter(lambda a: a["type"] != "p", annotations))
-
-            if not highlight_title:
-                annotations = list(filter(lambda a: a["type"] != "title", annotations))
-
-            if not highlight_head:
-                annotations = list(filter(lambda a: a["type"] != "head", annotations))
-
-            if not highlight_citations:
-                annotations = list(
-                    filter(lambda a: a["type"] != "biblStruct", annotations)
-                )
-
-            if not highlight_notes:
-                annotations = list(filter(lambda a: a["type"] != "note", annotations))
-
-            if not highlight_callout:
-                annotations = list(filter(lambda a: a["type"] != "ref", annotations))
-
-            if not highlight_formulas:
-                annotations = list(
-                    filter(lambda a: a["type"] != "formula", annotations)
-                )
-
-            if not highlight_person_names:
-                annotations = list(
-                    filter(lambda a: a["type"] != "persName", annotations)
-                )
-
-            if not highlight_figures:
-                annotations = list(filter(lambda a: a["type"] != "figure", annotations))
-
-            if not highlight_affiliations:
-                annotations = list(
-                    filter(lambda a: a["type"] != "affiliation", annotations)
-                )
+        window_start = 1
+        if lazy_rendering and st.session_state["pages"]:
+            window_start = st.number_input(
+                "First page of the window",
+                min_value=1,
+                max_value=st.session_state["pages"],
+                value=1,
+                step=window_size,
+                disabled=bool(st.session_state["page_selection"]),
+            )
 
-            if height > -1:
-                pdf_viewer(
-                    input=st.session_state["binary"],
-                    width=width,
-                    height=height,
-                    annotations=annotations,
-                    pages_vertical_spacing=pages_vertical_spacing,
-                    annotation_outline_size=annotation_thickness,
-                    pages_to_render=st.session_state["page_selection"],
-                )
-            else:
-                pdf_viewer(
-                    input=st.session_state["binary"],
-                    width=width,
-                    annotations=annotations,
-                    pages_vertical_spacing=pages_vertical_spacing,
-                    annotation_outline_size=annotation_thickness,
-                    pages_to_render=st.session_state["page_selection"],
-                )
+        if st.session_state["hash"]:
+            with st.spinner("Rendering PDF document"):
+                store = get_document_annotations()
+                disabled_types = [
+                    type
+                    for type, enabled in (
+                        ("s", highlight_sentences),
+                        ("p", highlight_paragraphs),
+                        ("title", highlight_title),
+                        ("head", highlight_head),
+                        ("biblStruct", highlight_citations),
+                        ("note", highlight_notes),
+                        ("ref", highlight_callout),
+                        ("formula", highlight_formulas),
+                        ("persName", highlight_person_names),
+                        ("figure", highlight_figures),
+                        ("affiliation", highlight_affiliations),
+                    )
+                    if not enabled
+                ]
+                enabled_types = [
+                    type for type in store.types if type not in disabled_types
+                ]
+                binary = get_document_path()
+                pages_to_render = st.session_state["page_selection"]
+                if lazy_rendering:
+                    page_window = get_page_window(st.session_state["hash"], binary)
+                    window = sorted(pages_to_render)
+                    if not window:
+                        window = page_window.get_window(window_start, window_size)
+                        page_window.prefetch(window[0], window_size)
+                    binary = page_window.get_slice(window)
+                    with tracer.span("annotations.select") as span:
+                        annotations = page_window.remap(
+                            store.to_dicts(store.select(enabled_types, window)),
+                            window,
+                        )
+                        span.set(count=len(annotations))
+                    pages_to_render = []
+                else:
+                    with tracer.span("annotations.select") as span:
+                        annotations = store.to_dicts(
+                            store.select(enabled_types, pages_to_render)
+                        )
+                        span.set(count=len(annotations))
+
+                with tracer.span(
+                    "viewer.render", annotations=len(annotations)
+                ) as span:
+                    span.set(
+                        bytes=len(binary)
+                        if isinstance(binary, bytes)
+                        else os.path.getsize(binary)
+                    )
+                    if height > -1:
+                        pdf_viewer(
+                            input=binary,
+                            width=width,
+                            height=height,
+                            annotations=annotations,
+                            pages_vertical_spacing=pages_vertical_spacing,
+                            annotation_outline_size=annotation_thickness,
+                            pages_to_render=pages_to_render,
+                        )
+                    else:
+                        pdf_viewer(
+                            input=binary,
+                            width=width,
+                            annotations=annotations,
+                            pages_vertical_spacing=pages_vertical_spacing,
+                            annotation_outline_size=annotation_thickness,
+                            pages_to_render=pages_to_render,
+                        )
 
 
 with middle_column:
     st.markdown("### Here you can get your segments")
-    if uploaded_file:
-        filtered_sorted_segments = [
-            {k: d[k] for k in ("type", "text")}
-            for d in sorted(annotations, key=lambda x: x["type"])
-        ]
-        segments = [
-            segment
-            for segment in filtered_sorted_segments
-            if len(str(segment["text"]).strip()) > 5
-        ]
-        st.session_state["segments"] = (
-            segments
-            if not st.session_state["segments"]
-            else st.session_state["segments"]
+    if uploaded_file and st.session_state["hash"]:
+        query = st.text_input(
+            "Search segments", placeholder="Filter the segments by their text"
         )
-        labels = set()
-        with st.spinner("Creating options..."):
-            type_title = ""
-            for segment in st.session_state["segments"]:
-                label = str(segment["text"]).strip()
-                if not (label in labels):
-                    labels.add(label)
-                    if segment["type"] != type_title:
-                        st.markdown(f'### {segment["type"]}')
-                        type_title = segment["type"]
-                    try:
-                        st.button(
-                            label,
-                            on_click=partial(
-                                llama_write_answer,
-                                prompt=f"give technical explanation about this topic: \n{label}",
-                            ),
-                        )
-                    except Exception as e:
-                        print(f"Error for {segment}, exception is: {e}")
+        if is_complete():
+            segments = search_segments(
+                st.session_state["hash"], tuple(enabled_types), query.strip()
+            )
+        else:
+            segments = [
+                segment
+                for segment in store.get_segments(enabled_types)
+                if query.strip().lower() in segment[1].lower()
+            ]
+        page_count = max((len(segments) - 1) // SEGMENTS_PER_PAGE + 1, 1)
+        segment_page = st.number_input(
+            f"Page of segments ({len(segments)} found)",
+            min_value=1,
+            max_value=page_count,
+            value=1,
+        )
+        start = (segment_page - 1) * SEGMENTS_PER_PAGE
+        # only one page of buttons, whatever the size of the document
+        type_title = ""
+        for type, label in segments[start : start + SEGMENTS_PER_PAGE]:
+            if type != type_title:
+                st.markdown(f"### {type}")
+                type_title = type
+            st.button(
+                label,
+                on_click=partial(
+                    llama_write_answer,
+                    prompt=EXPLAIN_PROMPT.format(label=label),
+                ),
+                disabled=backend is None,
+            )
 
 
 with left_column:
@@ -475,8 +891,20 @@ with left_column:
         with st.chat_message(message["role"]):
             st.write(message["content"])
     if prompt := st.chat_input(
-        placeholder="Ask a question", max_chars=300, disabled=not replicate_api
+        placeholder="Ask a question", max_chars=300, disabled=backend is None
     ):
+        if "prefetcher" in st.session_state:
+            # the question goes before the explanations nobody asked for yet
+            st.session_state["prefetcher"].cancel()
         write_prompt(prompt)
 
-    llama_answer(prompt)
+    llama_answer()
+
+if trace is not None:
+    tracer.finish(trace)
+    st.session_state["last_trace"] = trace.breakdown()
+
+if uploaded_file and in_progress:
+    # picks up the annotations of the full text as they arrive
+    time.sleep(2)
+    st.rerun()
@@ -0,0 +1,80 @@
+"""Time the annotation selection done on every rerun of the application.
+
+    python -m benchmarks.bench_annotation_filter [--pages 50]
+
+Compares the former chain of list filters, over the dicts materialized from
+the store, with the per type/page index of AnnotationStore. Dicts handed to
+the viewer are included in both timings.
+"""
+
+import argparse
+import time
+
+from benchmarks.fixtures import synthetic_annotations
+from grobid.annotations import AnnotationStore
+
+SCENARIOS = {
+    "all types": (),
+    "defaults": ("s", "p"),
+    "defaults, 2 pages": ("s", "p"),
+}
+
+
+def filter_chain(store, disabled_types):
+    # the former render path: one full scan per toggle turned off
+    annotations = store.to_dicts()
+    for type in disabled_types:
+        annotations = list(filter(lambda a: a["type"] != type, annotations))
+    return annotations
+
+
+def index_select(store, disabled_types, pages):
+    types = [type for type in store.types if type not in disabled_types]
+    return store.to_dicts(store.select(types, pages))
+
+
+def best_of(func, rounds, *args):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    annotations = synthetic_annotations(args.pages)
+    start = time.perf_counter()
+    store = AnnotationStore.from_dicts(annotations)
+    store.build_index()
+    build_time = time.perf_counter() - start
+    print(
+        f"{args.pages} pages, {len(store)} boxes, "
+        f"index built in {build_time * 1000:.1f} ms"
+    )
+
+    for name, disabled_types in SCENARIOS.items():
+        pages = [3, 4] if "pages" in name else []
+        expected, chain_time = best_of(
+            filter_chain, args.rounds, store, disabled_types
+        )
+        if pages:
+            expected = [a for a in expected if a["page"] in pages]
+        result, index_time = best_of(
+            index_select, args.rounds, store, disabled_types, pages
+        )
+        assert result == expected
+        print(
+            f"{name:>18}: {len(result):6d} boxes, "
+            f"filter chain {chain_time * 1000:7.2f} ms, "
+            f"index {index_time * 1000:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Time the segment column of the application, done on every rerun.
+
+    python -m benchmarks.bench_rerun [--pages 50]
+
+Compares the former path, which sorted the dicts of every annotation and
+emitted one button per distinct text, with the segment list memoized per
+document and types, searched and cut to one page of buttons. A rerun after
+a slider drag or a chat message hits the memoized list. The rerun of a
+script emitting the buttons is timed with Streamlit's AppTest.
+"""
+
+import argparse
+import time
+from functools import lru_cache
+
+from benchmarks.fixtures import synthetic_annotations
+from grobid.annotations import AnnotationStore
+
+SEGMENTS_PER_PAGE = 25
+
+BUTTONS_SCRIPT = """
+import streamlit as st
+
+type_title = ""
+for type, label in st.session_state["buttons"]:
+    if type != type_title:
+        st.markdown(f"### {type}")
+        type_title = type
+    st.button(label)
+"""
+
+
+def former_path(store, types):
+    filtered_sorted_segments = [
+        {k: d[k] for k in ("type", "text")}
+        for d in sorted(store.to_dicts(store.select(types)), key=lambda x: x["type"])
+    ]
+    segments = [
+        segment
+        for segment in filtered_sorted_segments
+        if len(str(segment["text"]).strip()) > 5
+    ]
+    labels = set()
+    widgets = []
+    for segment in segments:
+        label = str(segment["text"]).strip()
+        if label not in labels:
+            labels.add(label)
+            widgets.append((segment["type"], label))
+    return widgets
+
+
+def get_search(store):
+    # stands for the st.cache_resource functions of the application
+    @lru_cache(maxsize=32)
+    def get_segments(types):
+        return store.get_segments(list(types))
+
+    @lru_cache(maxsize=64)
+    def search_segments(types, query):
+        segments = get_segments(types)
+        if not query:
+            return segments
+        query = query.lower()
+        return [segment for segment in segments if query in segment[1].lower()]
+
+    return search_segments
+
+
+def paginated_path(search_segments, types, query="", page=1):
+    segments = search_segments(tuple(types), query)
+    start = (page - 1) * SEGMENTS_PER_PAGE
+    return segments[start : start + SEGMENTS_PER_PAGE]
+
+
+def time_widgets(buttons):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_string(BUTTONS_SCRIPT, default_timeout=60)
+    app.session_state["buttons"] = buttons
+    app.run()
+    start = time.perf_counter()
+    app.run()
+    return time.perf_counter() - start
+
+
+def best_of(func, rounds, *args):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    store = AnnotationStore.from_dicts(synthetic_annotations(args.pages))
+    store.build_index()
+    types = [type for type in store.types if type != "s"]
+    print(f"{args.pages} pages, {len(store)} boxes")
+
+    widgets, former_time = best_of(former_path, args.rounds, store, types)
+    print(
+        f"{'former':>14}: {len(widgets):6d} buttons, {former_time * 1000:8.2f} ms, "
+        f"widgets rerun {time_widgets(widgets) * 1000:8.1f} ms"
+    )
+
+    search_segments = get_search(store)
+    start = time.perf_counter()
+    buttons = paginated_path(search_segments, types)
+    cold_time = time.perf_counter() - start
+    assert search_segments(tuple(types), "") == widgets
+    print(
+        f"{'first run':>14}: {len(buttons):6d} buttons, {cold_time * 1000:8.2f} ms, "
+        f"widgets rerun {time_widgets(buttons) * 1000:8.1f} ms"
+    )
+    for name, query, page in (("rerun", "", 1), ("rerun, page 3", "", 3)):
+        buttons, rerun_time = best_of(
+            paginated_path, args.rounds, search_segments, types, query, page
+        )
+        print(f"{name:>14}: {len(buttons):6d} buttons, {rerun_time * 1000:8.2f} ms")
+    start = time.perf_counter()
+    buttons = paginated_path(search_segments, types, "attention")
+    search_time = time.perf_counter() - start
+    print(f"{'new search':>14}: {len(buttons):6d} buttons, {search_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare ImageProcessor.get_segment with get_segment_fast.
+
+    python -m benchmarks.bench_segmentation [--dpi 150]
+
+The pages of the sample paper are preprocessed and dilated as in the test
+notebook, then segmented by both methods.
+"""
+
+import argparse
+import time
+
+from benchmarks.fixtures import SAMPLE_PDF
+from src.pager import Pager
+from src.preprocessing import ImageProcessor
+
+
+def prepare(pdf_path, dpi):
+    pager = Pager("", pdf_path, "png", dpi=dpi)
+    inputs = []
+    for _, pix in pager.pixmaps():
+        processor = ImageProcessor.from_pixmap(pix)
+        gray = processor.get_gray_scale()
+        blur = processor.get_blur((7, 7), gray)
+        thresh = processor.get_threshold((0, 300), blur)
+        dilate = processor.get_dilate((13, 13), iterations=5, in_image=thresh)
+        inputs.append((processor, dilate))
+    return inputs
+
+
+def run(inputs, segment, **kwargs):
+    start = time.perf_counter()
+    results = [segment(processor, dilate, **kwargs)[1] for processor, dilate in inputs]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", default=SAMPLE_PDF)
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    inputs = prepare(args.pdf, args.dpi)
+    methods = {
+        "get_segment": (ImageProcessor.get_segment, {}),
+        "fast, contours": (ImageProcessor.get_segment_fast, {}),
+        "fast, components": (
+            ImageProcessor.get_segment_fast,
+            {"method": "components"},
+        ),
+    }
+    results = {}
+    for name, (segment, kwargs) in methods.items():
+        timings = []
+        for _ in range(args.rounds):
+            roi, elapsed = run(inputs, segment, **kwargs)
+            timings.append(elapsed)
+        results[name] = roi
+        elapsed = min(timings)
+        regions = sum(len(page) for page in roi)
+        print(
+            f"{name:>17}: {elapsed / len(inputs) * 1000:7.2f} ms/page, "
+            f"{len(inputs) / elapsed * 60:9.0f} pages/min, {regions} regions"
+        )
+
+    same = all(
+        sorted(box for _, box in old) == sorted(box for _, box in new)
+        for old, new in zip(results["get_segment"], results["fast, contours"])
+    )
+    print(f"same regions as get_segment: {same}")
+
+
+if __name__ == "__main__":
+    main()
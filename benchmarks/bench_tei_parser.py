@@ -0,0 +1,67 @@
+"""Compare the BeautifulSoup TEI extraction with the streaming parser.
+
+    python -m benchmarks.bench_tei_parser [--tei path] [--record] [--repeat n]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.fixtures import SAMPLE_TEI, load_tei, synthetic_tei
+from grobid.grobid_processor import GrobidProcessor
+
+
+def soup_parse(processor, text):
+    return processor.get_coordinates(text), processor.get_pages(text)
+
+
+def stream_parse(processor, text):
+    return processor.parse_tei(text)
+
+
+def measure(func, processor, text, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(processor, text)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(processor, text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tei", default=SAMPLE_TEI)
+    parser.add_argument(
+        "--record", action="store_true", help="call GROBID when no TEI is recorded"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=0, help="use a synthetic TEI of n copies"
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.repeat:
+        text = synthetic_tei(repeat=args.repeat)
+    else:
+        text = load_tei(args.tei, record=args.record)
+    processor = GrobidProcessor(None)
+
+    expected, soup_time, soup_peak = measure(soup_parse, processor, text, args.rounds)
+    result, stream_time, stream_peak = measure(
+        stream_parse, processor, text, args.rounds
+    )
+    if result != expected:
+        raise SystemExit("The streaming parser output differs from BeautifulSoup")
+
+    print(f"TEI size: {len(text) / 1024:.0f} KiB, boxes: {len(result[0])}")
+    print(f"beautifulsoup: {soup_time * 1000:8.1f} ms, peak {soup_peak / 2**20:6.1f} MiB")
+    print(f"streaming:     {stream_time * 1000:8.1f} ms, peak {stream_peak / 2**20:6.1f} MiB")
+    print(f"speedup:       {soup_time / stream_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import os
+import random
+from xml.sax.saxutils import escape
+
+import fitz
+from lxml import etree
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(BASE_DIR, "benchmarks", "fixtures")
+SAMPLE_PDF = os.path.join(BASE_DIR, "data", "1706.03762.pdf")
+SAMPLE_TEI = os.path.join(FIXTURES_DIR, "1706.03762.tei.xml")
+
+TEI_NS = "http://www.tei-c.org/ns/1.0"
+
+
+def record_tei(pdf_path=SAMPLE_PDF, out_path=SAMPLE_TEI, config_path=None):
+    # imported here so that the benchmarks run without a GROBID client installed
+    from grobid_client.grobid_client import GrobidClient
+
+    from grobid.grobid_processor import GROBID_OPTIONS, GROBID_SERVICE
+
+    config_path = config_path or os.path.join(BASE_DIR, "config.json")
+    client = GrobidClient(config_path=config_path)
+    _, status, text = client.process_pdf(GROBID_SERVICE, pdf_path, **GROBID_OPTIONS)
+    if status != 200:
+        raise RuntimeError(f"GROBID answered {status} for {pdf_path}")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as fw:
+        fw.write(text)
+    return text
+
+
+def box(page, rect):
+    x0, y0, x1, y1 = rect
+    return f"{page},{x0:.2f},{y0:.2f},{x1 - x0:.2f},{y1 - y0:.2f}"
+
+
+def synthetic_bibl(number, block):
+    # "[1] Jimmy Lei Ba, Jamie Ryan Kiros, and Geoffrey E Hinton. Layer ..."
+    lines = [
+        "".join(span["text"] for span in line["spans"]) for line in block["lines"]
+    ]
+    authors, _, title = " ".join(lines).partition("] ")[2].partition(". ")
+    names = authors.split(",")[0].split()
+    forenames = "".join(
+        f'<forename type="first">{escape(name)}</forename>' for name in names[:-1]
+    )
+    return (
+        f'<biblStruct coords="{box(number, block["bbox"])}">'
+        f'<analytic><title level="a" type="main">{escape(title)}</title>'
+        f'<author><persName coords="{box(number, block["lines"][0]["bbox"])}">'
+        f"{forenames}<surname>{escape(names[-1] if names else '')}</surname>"
+        "</persName></author></analytic>"
+        '<monogr><imprint><date type="published">2017</date></imprint></monogr>'
+        "</biblStruct>"
+    )
+
+
+def synthetic_tei(pdf_path=SAMPLE_PDF, repeat=1, indent=True):
+    """Build a TEI document shaped like GROBID's output from the PDF text layer.
+
+    Every text block becomes a paragraph and every line a sentence, with the
+    first word of each sentence wrapped in a reference; the blocks starting
+    with "[" are bibliographical references. ``repeat`` appends the document
+    to itself to get arbitrarily long papers, ``indent`` pretty prints it
+    with tabs as GROBID does.
+    """
+    doc = fitz.open(pdf_path)
+    surfaces = []
+    header = []
+    body = []
+    bibl = []
+    for r in range(repeat):
+        for page in doc:
+            number = r * doc.page_count + page.number + 1
+            width, height = page.rect.width, page.rect.height
+            surfaces.append(
+                f'<surface n="{number}" ulx="0.0" uly="0.0" '
+                f'lrx="{width:.1f}" lry="{height:.1f}"/>'
+            )
+            for block in page.get_text("dict")["blocks"]:
+                if block["type"] != 0:
+                    body.append(
+                        f'<figure coords="{box(number, block["bbox"])}">'
+                        f"<head>Figure {len(body)}</head></figure>"
+                    )
+                    continue
+                sentences = []
+                for line in block["lines"]:
+                    words = "".join(span["text"] for span in line["spans"]).split()
+                    if not words:
+                        continue
+                    first, rest = escape(words[0]), escape(" ".join(words[1:]))
+                    sentences.append(
+                        f'<s coords="{box(number, line["bbox"])}">'
+                        f'<ref type="bibr">{first}</ref> {rest}</s>'
+                    )
+                if not sentences:
+                    continue
+                if block["lines"][0]["spans"][0]["text"].startswith("["):
+                    bibl.append(synthetic_bibl(number, block))
+                    continue
+                if not header:
+                    header.append(
+                        f'<title level="a" type="main" '
+                        f'coords="{box(number, block["bbox"])}">'
+                        f"{escape(block['lines'][0]['spans'][0]['text'])}</title>"
+                    )
+                    continue
+                body.append(
+                    f'<p coords="{box(number, block["bbox"])}">'
+                    + "\n".join(sentences)
+                    + "</p>"
+                )
+    text = (
+        f'<TEI xmlns="{TEI_NS}" xmlns:xlink="http://www.w3.org/1999/xlink">'
+        f"<teiHeader><fileDesc><titleStmt>{''.join(header)}</titleStmt>"
+        "</fileDesc></teiHeader>"
+        f"<facsimile>{''.join(surfaces)}</facsimile>"
+        "<!-- synthetic document -->"
+        f"<text><body><div>{''.join(body)}</div></body>"
+        f"<back><div><listBibl>{''.join(bibl)}</listBibl></div></back></text></TEI>"
+    )
+    if indent:
+        tree = etree.fromstring(text)
+        etree.indent(tree, space="\t")
+        text = etree.tostring(tree, encoding="unicode")
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + text
+
+
+def synthetic_pdf(out_path, repeat=8, pdf_path=SAMPLE_PDF):
+    """Write the sample paper ``repeat`` times over into one long PDF."""
+    if not os.path.exists(out_path):
+        with fitz.open(pdf_path) as src, fitz.open() as doc:
+            for _ in range(repeat):
+                doc.insert_pdf(src)
+            doc.save(out_path)
+    return out_path
+
+
+# boxes per page of each type for a paper processed with sentences on
+BOXES_PER_PAGE = {
+    "s": 60,
+    "p": 25,
+    "ref": 12,
+    "head": 2,
+    "formula": 2,
+    "figure": 1,
+    "note": 1,
+    "biblStruct": 6,
+    "persName": 1,
+    "title": 0.1,
+    "affiliation": 0.2,
+}
+
+
+def synthetic_annotations(pages=50, seed=0):
+    """Annotations, as returned by GrobidProcessor, of a paper of ``pages`` pages."""
+    from grobid.grobid_processor import get_color
+
+    rng = random.Random(seed)
+    annotations = []
+    count = 0
+    for page in range(1, pages + 1):
+        for type, per_page in BOXES_PER_PAGE.items():
+            boxes = int(per_page) + (rng.random() < per_page % 1)
+            for _ in range(boxes):
+                text = " ".join(
+                    rng.choice(("attention", "model", "layer", "the", "of", "is"))
+                    for _ in range(rng.randint(3, 30))
+                )
+                color = get_color(type, count % 2 == 0)
+                count += 1
+                for _ in range(rng.randint(1, 3)):
+                    annotations.append(
+                        {
+                            "page": str(page),
+                            "x": f"{rng.uniform(50, 500):.2f}",
+                            "y": f"{rng.uniform(50, 700):.2f}",
+                            "width": f"{rng.uniform(10, 400):.2f}",
+                            "height": f"{rng.uniform(8, 12):.2f}",
+                            "text": text,
+                            "color": color,
+                            "type": type,
+                        }
+                    )
+    return annotations
+
+
+def load_tei(path=SAMPLE_TEI, pdf_path=SAMPLE_PDF, record=False):
+    """Return the recorded TEI of the sample paper.
+
+    When no recording exists, GROBID is called to make one if ``record`` is
+    set, otherwise a synthetic TEI is built from the PDF.
+    """
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fr:
+            return fr.read()
+    if record:
+        return record_tei(pdf_path, path)
+    return synthetic_tei(pdf_path)
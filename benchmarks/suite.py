@@ -0,0 +1,326 @@
+"""Time the document pipeline on fixed fixtures and compare with a baseline.
+
+    python -m benchmarks.suite [--cases tei,image] [--min-time 1]
+    python -m benchmarks.suite --save-baseline
+
+Each case runs in a fresh process, on the sample paper, a long PDF made of
+copies of it, the recorded TEI (a synthetic one without recording, GROBID is
+never called) and synthetic annotations. A case is timed for at least
+``--rounds`` rounds and ``--min-time`` seconds; a fast case is called many
+times per round, for ``--sample-time``. The report gives per case the
+minimum, p50 and p95 latency, the throughput in items per second at p50 and
+the peak RSS, written as JSON with ``--output``.
+
+With a baseline, from ``--save-baseline`` on the same machine, a case slower
+or bigger than the tolerances is measured again ``--confirm`` times and is a
+regression when it stays so, the exit status is then 1. The speed of a
+shared machine drifts within minutes: by default the times compared are
+``relative``, the median ratio of each round to a calibration run next to it.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def setup_tei(method, repeat=0):
+    from benchmarks.fixtures import load_tei, synthetic_tei
+    from grobid.grobid_processor import GrobidProcessor
+
+    def setup(args):
+        text = synthetic_tei(repeat=repeat) if repeat else load_tei()
+        processor = GrobidProcessor(None)
+        coordinates, pages = processor.parse_tei(text)
+        items = len(pages) if method == "get_pages" else len(coordinates)
+        return lambda: getattr(processor, method)(text), items
+
+    return setup
+
+
+def setup_pager(method, repeat=0):
+    from benchmarks.fixtures import SAMPLE_PDF, synthetic_pdf
+    from src.pager import Pager
+
+    def setup(args):
+        pdf_path = SAMPLE_PDF
+        if repeat:
+            pdf_path = synthetic_pdf(
+                os.path.join(args.tmp_dir, f"sample-x{repeat}.pdf"), repeat
+            )
+        pager = Pager("", pdf_path, "png", dpi=args.dpi)
+
+        def run():
+            for _ in getattr(pager, method)():
+                pass
+
+        return run, pager._doc.page_count
+
+    return setup
+
+
+def setup_preprocess(args):
+    from benchmarks.fixtures import SAMPLE_PDF
+    from src.pager import Pager
+    from src.preprocessing import ImageProcessor
+
+    pager = Pager("", SAMPLE_PDF, "png", dpi=args.dpi)
+    processors = [ImageProcessor.from_pixmap(pix) for _, pix in pager.pixmaps()]
+
+    def run():
+        for processor in processors:
+            processor.reset_image()
+            processor.preprocess()
+
+    return run, len(processors)
+
+
+def setup_segment(method):
+    def setup(args):
+        from benchmarks.bench_segmentation import prepare
+        from benchmarks.fixtures import SAMPLE_PDF
+
+        inputs = prepare(SAMPLE_PDF, args.dpi)
+
+        def run():
+            for processor, dilate in inputs:
+                getattr(processor, method)(dilate)
+
+        return run, len(inputs)
+
+    return setup
+
+
+def setup_annotations(method):
+    def setup(args):
+        from benchmarks.fixtures import synthetic_annotations
+        from grobid.annotations import AnnotationStore
+
+        store = AnnotationStore.from_dicts(synthetic_annotations(args.pages))
+        store.build_index()
+        # the application's default toggles: all but sentences and paragraphs
+        types = [type for type in store.types if type not in ("s", "p")]
+        if method == "select":
+            return lambda: store.to_dicts(store.select(types)), len(store)
+        return lambda: store.get_segments(types), len(store)
+
+    return setup
+
+
+# name: (setup, unit of the throughput)
+CASES = {
+    "tei.get_coordinates": (setup_tei("get_coordinates"), "boxes"),
+    "tei.get_pages": (setup_tei("get_pages"), "pages"),
+    "tei.parse_tei": (setup_tei("parse_tei"), "boxes"),
+    "tei.parse_tei, x8": (setup_tei("parse_tei", repeat=8), "boxes"),
+    "pager.pixmaps": (setup_pager("pixmaps"), "pages"),
+    "pager.rasterize": (setup_pager("rasterize"), "pages"),
+    "pager.rasterize, x8": (setup_pager("rasterize", repeat=8), "pages"),
+    "image.preprocess": (setup_preprocess, "pages"),
+    "image.get_segment": (setup_segment("get_segment"), "pages"),
+    "image.get_segment_fast": (setup_segment("get_segment_fast"), "pages"),
+    "annotations.select": (setup_annotations("select"), "boxes"),
+    "annotations.get_segments": (setup_annotations("get_segments"), "boxes"),
+}
+
+
+def get_peak_rss():
+    # ru_maxrss is in KiB on Linux, the rasterization workers are children
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak * (1 if sys.platform == "darwin" else 1024)
+
+
+def calibrate():
+    """Seconds of a fixed mix of interpreter and NumPy work.
+
+    Timed next to every sample: the speed of a shared machine drifts by tens
+    of percents within a minute, the ratio of a sample to its calibration
+    does not.
+    """
+    start = time.perf_counter()
+    total = 0
+    for i in range(100_000):
+        total += i * i % 7
+    (np.arange(500_000, dtype=np.float64) * 1.0001).sum()
+    return time.perf_counter() - start
+
+
+def run_case(name, args):
+    setup, unit = CASES[name]
+    func, items = setup(args)
+    start = time.perf_counter()
+    for _ in range(args.warmup):
+        func()
+    # the calls per sample, a sample of a fast case lasts --sample-time
+    elapsed = (time.perf_counter() - start) / max(args.warmup, 1)
+    number = max(1, math.ceil(args.sample_time / max(elapsed, 1e-9)))
+    timings = []
+    relative = []
+    end = time.perf_counter() + args.min_time
+    while len(timings) < args.rounds or (
+        time.perf_counter() < end and len(timings) < args.max_rounds
+    ):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+        relative.append(timings[-1] / min(calibrate() for _ in range(3)))
+    p50, p95 = np.percentile(timings, [50, 95])
+    return {
+        "items": items,
+        "unit": unit,
+        "rounds": len(timings),
+        "number": number,
+        "min": min(timings),
+        "p50": p50,
+        "p95": p95,
+        # in calibration runs, what the regressions are checked on
+        "relative": float(np.median(relative)),
+        "throughput": items / p50,
+        "peak_rss": get_peak_rss(),
+    }
+
+
+def get_environment():
+    import cv2
+    import fitz
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "pymupdf": fitz.VersionBind,
+    }
+
+
+def compare(results, baseline, args, names=None):
+    """Return the names of the cases slower or bigger than the baseline."""
+    statistic = args.statistic
+    regressions = []
+    for name in names or results["cases"]:
+        result = results["cases"][name]
+        base = baseline["cases"].get(name)
+        if base is None or statistic not in base:
+            continue
+        time_ratio = result[statistic] / base[statistic]
+        rss_ratio = result["peak_rss"] / base["peak_rss"]
+        flags = []
+        if time_ratio > 1 + args.tolerance:
+            flags.append("slower")
+        if rss_ratio > 1 + args.rss_tolerance:
+            flags.append("bigger")
+        if flags:
+            regressions.append(name)
+        print(
+            f"{name:>26}: {statistic} {time_ratio:5.2f}x, peak RSS {rss_ratio:5.2f}x "
+            f"of the baseline{''.join(f', {flag}' for flag in flags)}"
+        )
+    return regressions
+
+
+def measure(name, args):
+    # a fresh process per case, for its own peak RSS
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+        result = executor.submit(run_case, name, args).result()
+    print(
+        f"{name:>26}: min {result['min'] * 1000:8.2f} ms, "
+        f"p50 {result['p50'] * 1000:8.2f} ms, "
+        f"p95 {result['p95'] * 1000:8.2f} ms ({result['rounds']} rounds), "
+        f"{result['throughput']:10.0f} {result['unit']}/s, "
+        f"peak RSS {result['peak_rss'] / 2**20:6.0f} MiB"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--cases", default="", help="comma separated prefixes of the case names"
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="at least")
+    parser.add_argument(
+        "--min-time", type=float, default=1.0, help="seconds of rounds per case"
+    )
+    parser.add_argument("--max-rounds", type=int, default=1000)
+    parser.add_argument(
+        "--sample-time", type=float, default=0.05, help="seconds of calls per round"
+    )
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--pages", type=int, default=50, help="of the annotations")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="write the report as baseline"
+    )
+    parser.add_argument(
+        "--statistic", choices=("relative", "min", "p50", "p95"), default="relative"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--rss-tolerance", type=float, default=0.1)
+    parser.add_argument(
+        "--confirm", type=int, default=2, help="measures again of a regression"
+    )
+    args = parser.parse_args()
+
+    prefixes = [prefix for prefix in args.cases.split(",") if prefix]
+    names = [
+        name
+        for name in CASES
+        if not prefixes or any(name.startswith(prefix) for prefix in prefixes)
+    ]
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fr:
+            baseline = json.load(fr)
+    results = {"environment": get_environment(), "cases": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args.tmp_dir = tmp_dir
+        for name in names:
+            results["cases"][name] = measure(name, args)
+        if baseline is not None and not args.save_baseline:
+            if baseline["environment"] != results["environment"]:
+                print("The baseline was recorded in another environment")
+            regressions = compare(results, baseline, args)
+            for _ in range(args.confirm):
+                if not regressions:
+                    break
+                # a regression holds on every measure, noise does not
+                print(f"Measuring again: {', '.join(regressions)}")
+                for name in regressions:
+                    result = measure(name, args)
+                    if result[args.statistic] < results["cases"][name][args.statistic]:
+                        results["cases"][name] = result
+                regressions = compare(results, baseline, args, regressions)
+
+    if args.output:
+        with open(args.output, "w") as fw:
+            json.dump(results, fw, indent=2)
+    if args.save_baseline:
+        # the cases not run keep their former baseline
+        if baseline is not None:
+            results["cases"] = {**baseline["cases"], **results["cases"]}
+        with open(args.baseline, "w") as fw:
+            json.dump(results, fw, indent=2)
+    elif baseline is not None and regressions:
+        raise SystemExit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
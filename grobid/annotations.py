@@ -0,0 +1,182 @@
+import json
+import os
+
+import numpy as np
+
+ARRAYS = ("pages", "geometry", "type_codes", "color_codes", "text_codes")
+
+
+class AnnotationStore:
+    """Columnar storage of the annotation boxes of a document.
+
+    Geometry lives in NumPy arrays, type and color are categorical codes and
+    the texts are deduplicated, so that the boxes of an element share one
+    string. Dicts are only built for the boxes handed to the viewer.
+    """
+
+    def __init__(
+        self,
+        pages,
+        geometry,
+        type_codes,
+        types,
+        color_codes,
+        colors,
+        text_codes,
+        texts,
+    ) -> None:
+        self.pages = pages
+        # x, y, width, height
+        self.geometry = geometry
+        self.type_codes = type_codes
+        self.types = types
+        self.color_codes = color_codes
+        self.colors = colors
+        self.text_codes = text_codes
+        self.texts = texts
+        self._index = None
+
+    @classmethod
+    def from_dicts(cls, annotations):
+        types, colors, texts = {}, {}, {}
+        type_codes = np.empty(len(annotations), dtype=np.uint8)
+        color_codes = np.empty(len(annotations), dtype=np.uint8)
+        text_codes = np.empty(len(annotations), dtype=np.int32)
+        for i, annotation in enumerate(annotations):
+            type_codes[i] = types.setdefault(annotation.get("type"), len(types))
+            color_codes[i] = colors.setdefault(annotation.get("color"), len(colors))
+            text_codes[i] = texts.setdefault(annotation["text"], len(texts))
+
+        pages = np.array([int(a["page"]) for a in annotations], dtype=np.int32)
+        geometry = np.array(
+            [[a["x"], a["y"], a["width"], a["height"]] for a in annotations],
+            dtype=np.float32,
+        ).reshape(-1, 4)
+        return cls(
+            pages,
+            geometry,
+            type_codes,
+            list(types),
+            color_codes,
+            list(colors),
+            text_codes,
+            list(texts),
+        )
+
+    def save(self, directory):
+        # one .npy per column, so that they can be memory mapped back
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "strings.json"), "w") as fw:
+            json.dump(
+                {"types": self.types, "colors": self.colors, "texts": self.texts}, fw
+            )
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ARRAYS
+        }
+        with open(os.path.join(directory, "strings.json")) as fr:
+            strings = json.load(fr)
+        return cls(**arrays, **strings)
+
+    def __len__(self):
+        return len(self.pages)
+
+    @property
+    def nbytes(self):
+        arrays = (
+            self.pages,
+            self.geometry,
+            self.type_codes,
+            self.color_codes,
+            self.text_codes,
+        )
+        return sum(a.nbytes for a in arrays) + sum(len(t) for t in self.texts)
+
+    def build_index(self):
+        # box indices grouped by type then page, each group in document order
+        self._index = {}
+        if len(self) == 0:
+            return
+        order = np.lexsort((self.pages, self.type_codes)).astype(np.int32)
+        keys = np.stack((self.type_codes[order], self.pages[order]), axis=1)
+        starts = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+        starts = np.concatenate(([0], starts)).astype(np.int64)
+        ends = np.concatenate((starts[1:], [len(order)]))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            type, page = keys[start].tolist()
+            self._index.setdefault(self.types[type], {})[page] = order[start:end]
+
+    def select(self, types=None, pages=None):
+        """Return the indices, in document order, of the boxes of the given
+        types lying on the given pages (all of them when None)."""
+        if self._index is None:
+            self.build_index()
+        if types is None:
+            types = self._index.keys()
+        elif not pages and set(types) >= self._index.keys():
+            return np.arange(len(self), dtype=np.int32)
+        groups = []
+        for type in types:
+            by_page = self._index.get(type, {})
+            if pages:
+                groups.extend(by_page[page] for page in pages if page in by_page)
+            else:
+                groups.extend(by_page.values())
+        if not groups:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(groups))
+
+    def to_dicts(self, indices=None):
+        if indices is None:
+            indices = slice(None)
+        # GROBID gives two decimals, rounding drops the float32 noise
+        geometry = self.geometry[indices].astype(np.float64).round(2).tolist()
+        pages = self.pages[indices].tolist()
+        texts = self.texts
+        types = self.types
+        colors = self.colors
+        annotations = []
+        for page, (x, y, width, height), text, color, type in zip(
+            pages,
+            geometry,
+            self.text_codes[indices].tolist(),
+            self.color_codes[indices].tolist(),
+            self.type_codes[indices].tolist(),
+        ):
+            item = {
+                "page": page,
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "text": texts[text],
+            }
+            if colors[color] is not None:
+                item["color"] = colors[color]
+            if types[type]:
+                item["type"] = types[type]
+            annotations.append(item)
+        return annotations
+
+    def get_segments(self, types=None, min_chars: int = 6):
+        """Return the ``(type, text)`` of the distinct texts of the given
+        types, grouped by type name, each group in document order."""
+        indices = self.select(types)
+        type_codes = self.type_codes[indices]
+        # a stable sort keeps the document order within a type
+        names = np.array([self.types[code] or "" for code in range(len(self.types))])
+        order = np.argsort(names[type_codes], kind="stable")
+        segments, seen = [], set()
+        for type, text in zip(
+            type_codes[order].tolist(), self.text_codes[indices][order].tolist()
+        ):
+            label = str(self.texts[text]).strip()
+            if len(label) >= min_chars and label not in seen:
+                seen.add(label)
+                segments.append((self.types[type], label))
+        return segments
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import threading
+
+import httpx
+
+from grobid.grobid_processor import (
+    GROBID_OPTIONS,
+    GROBID_SERVICE,
+    GrobidProcessor,
+    get_file_hash,
+    get_form_data,
+)
+from grobid.pool import DEFAULT_CONFIG as POOL_CONFIG
+
+# config.json's, the elements with coordinates included
+DEFAULT_CONFIG = {"grobid_server": "http://localhost:8070", **POOL_CONFIG}
+
+
+class AsyncGrobidProcessor(GrobidProcessor):
+    """GrobidProcessor over a pooled asynchronous HTTP client.
+
+    At most ``n`` documents are sent to GROBID at once, which should match the
+    number of threads of the server; the others wait for a free slot instead of
+    being answered with a 503.
+
+    The coroutines are ``arequest_tei`` and ``aprocess_structure``. The
+    synchronous methods inherited from GrobidProcessor, ``process_document``
+    and the others, run ``arequest_tei`` on an event loop thread of their own;
+    an instance is used either from coroutines or synchronously, its client
+    belongs to one loop.
+    """
+
+    def __init__(
+        self,
+        config: dict = None,
+        n: int = 10,
+        max_retries: int = 5,
+        cache=None,
+    ) -> None:
+        super().__init__(None, cache=cache)
+        self._config = {**DEFAULT_CONFIG, **(config or {})}
+        self._n = n
+        self._max_retries = max_retries
+        self._slots = None
+        self._client = None
+        self._loop_thread = None
+
+    @classmethod
+    def from_config(cls, config_path="./config.json", **kwargs):
+        with open(config_path, "r") as fr:
+            return cls(json.load(fr), **kwargs)
+
+    @property
+    def config(self):
+        return self._config
+
+    def get_client(self):
+        # created lazily, the client and the semaphore belong to the running loop
+        if self._client is None:
+            self._slots = asyncio.Semaphore(self._n)
+            self._client = httpx.AsyncClient(
+                base_url=self._config["grobid_server"].rstrip("/") + "/api/",
+                limits=httpx.Limits(
+                    max_connections=self._n, max_keepalive_connections=self._n
+                ),
+                timeout=httpx.Timeout(self._config["timeout"], connect=10),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        self.get_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def is_alive(self):
+        try:
+            response = await self.get_client().get("isalive")
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    async def arequest_tei(self, input_path, service=GROBID_SERVICE, **options):
+        """Return ``(status, text)``; ``options`` are ``request_tei``'s, the
+        client's options and the ``start`` and ``end`` pages."""
+        client = self.get_client()
+        if isinstance(input_path, (bytes, bytearray, memoryview)):
+            name, content = "document.pdf", bytes(input_path)
+        else:
+            name = os.path.basename(input_path)
+            content = await asyncio.to_thread(self.read_file, input_path)
+        options = {**GROBID_OPTIONS, **options}
+        data = get_form_data(options, self._config["coordinates"])
+
+        status, text = None, None
+        for attempt in range(self._max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self._config["sleep_time"] * 2 ** (attempt - 1))
+            async with self._slots:
+                try:
+                    response = await client.post(
+                        service,
+                        files={"input": (name, content, "application/pdf")},
+                        data=data,
+                        headers={"Accept": "text/plain"},
+                    )
+                except httpx.TimeoutException:
+                    status, text = 408, None
+                    continue
+                except httpx.TransportError as e:
+                    print(f"Request to GROBID failed: {e}")
+                    status, text = None, None
+                    continue
+            status, text = response.status_code, response.text
+            if status != 503:
+                break
+        return status, text
+
+    def request_tei(self, input_path, service=GROBID_SERVICE, **options):
+        # for the synchronous callers, e.g. process_document
+        if self._loop_thread is None:
+            self._loop_thread = EventLoopThread()
+        return self._loop_thread.submit(
+            self.arequest_tei(input_path, service, **options)
+        ).result()
+
+    @staticmethod
+    def read_file(input_path):
+        with open(input_path, "rb") as f:
+            return f.read()
+
+    async def aprocess_structure(self, input_path, file_hash=None):
+        key = None
+        if self.cache is not None:
+            if file_hash is None:
+                file_hash = await asyncio.to_thread(get_file_hash, input_path)
+            key = self.cache_key(file_hash)
+            result = await asyncio.to_thread(self.load_result, key)
+            if result is not None:
+                return result["coordinates"], len(result["pages"])
+
+        status, text = await self.arequest_tei(input_path)
+
+        if status != 200:
+            return
+
+        coordinates, pages = await asyncio.to_thread(self.parse_tei, text)
+
+        if key is not None:
+            await asyncio.to_thread(self.save_result, key, text, coordinates, pages)
+
+        return coordinates, len(pages)
+
+
+class EventLoopThread:
+    """Event loop running in a daemon thread, to drive coroutines from sync code.
+
+    Keeps the pooled connections of an ``AsyncGrobidProcessor`` alive across
+    Streamlit reruns: ``submit`` returns a ``concurrent.futures.Future``.
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,230 @@
+"""Process a directory or a manifest of PDFs with GROBID.
+
+    python -m grobid.batch data/ --output output/ [--config config.json]
+
+Every document gets a ``<hash>.json`` file with its annotations and pages in
+the output directory. Finished documents are recorded in ``journal.jsonl``
+so that an interrupted run picks up where it stopped.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from grobid.grobid_processor import GrobidProcessor, get_file_hash
+from grobid.pool import GrobidPool
+from src.cache import DiskCache
+
+# answers worth another try: no server reached, busy server, client side
+# timeout, rate limiting
+RETRY_STATUSES = (None, 503, 408, 429)
+
+
+def load_config(config_path):
+    with open(config_path, "r") as fr:
+        return json.load(fr)
+
+
+def list_inputs(input_path):
+    if os.path.isdir(input_path):
+        paths = []
+        for root, _, files in os.walk(input_path):
+            paths.extend(
+                os.path.join(root, name)
+                for name in files
+                if name.lower().endswith(".pdf")
+            )
+        return sorted(paths)
+
+    # manifest: one path per line, relative to the manifest
+    base_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path, "r") as fr:
+        lines = [line.strip() for line in fr]
+    return [
+        os.path.join(base_dir, line)
+        for line in lines
+        if line and not line.startswith("#")
+    ]
+
+
+class Journal:
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(self._path):
+            with open(self._path, "r") as fr:
+                for line in fr:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line of a killed run
+                        continue
+                    if entry["status"] == "done":
+                        self.done.add(entry["hash"])
+
+    def write(self, **entry):
+        with self._lock:
+            with open(self._path, "a") as fw:
+                fw.write(json.dumps(entry) + "\n")
+            if entry["status"] == "done":
+                self.done.add(entry["hash"])
+
+
+class BatchProcessor:
+    def __init__(
+        self,
+        processor: GrobidProcessor,
+        output_dir,
+        n: int = 10,
+        batch_size: int = 1000,
+        sleep_time: float = 5,
+        max_retries: int = 5,
+    ) -> None:
+        self._processor = processor
+        self._output_dir = output_dir
+        self._n = n
+        self._batch_size = batch_size
+        self._sleep_time = sleep_time
+        self._max_retries = max_retries
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._journal = Journal(os.path.join(self._output_dir, "journal.jsonl"))
+
+    def output_path(self, file_hash):
+        return os.path.join(self._output_dir, f"{file_hash}.json")
+
+    def write_output(self, input_path, file_hash, coordinates, pages):
+        output_path = self.output_path(file_hash)
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as fw:
+            json.dump(
+                {
+                    "file": input_path,
+                    "hash": file_hash,
+                    "annotations": coordinates,
+                    "pages": pages,
+                },
+                fw,
+            )
+        os.replace(tmp_path, output_path)
+        return output_path
+
+    def request_with_retries(self, input_path):
+        status, text = None, None
+        for attempt in range(self._max_retries + 1):
+            if attempt > 0:
+                time.sleep(self._sleep_time * 2 ** (attempt - 1))
+            # GrobidPool hands the 503s back instead of retrying them itself
+            status, text = self._processor.request_tei(input_path)
+            if status not in RETRY_STATUSES:
+                break
+        return status, text
+
+    def process_file(self, input_path):
+        """Return "done", "skipped" or "failed"; a file that cannot be read,
+        parsed or written is recorded as failed and the batch goes on."""
+        file_hash = None
+        try:
+            file_hash = get_file_hash(input_path)
+            if file_hash in self._journal.done:
+                return "skipped"
+            return self.process_new_file(input_path, file_hash)
+        except Exception as e:
+            print(f"Processing failed for {input_path}: {e}")
+            self._journal.write(
+                path=input_path,
+                hash=file_hash,
+                status="failed",
+                error=f"{type(e).__name__}: {e}",
+            )
+            return "failed"
+
+    def process_new_file(self, input_path, file_hash):
+        start = time.time()
+        result = None
+        if self._processor.cache is not None:
+            key = self._processor.cache_key(file_hash)
+            result = self._processor.load_result(key)
+
+        if result is not None:
+            coordinates, pages = result["coordinates"], result["pages"]
+        else:
+            status, text = self.request_with_retries(input_path)
+            if status != 200:
+                self._journal.write(
+                    path=input_path, hash=file_hash, status="failed", code=status
+                )
+                return "failed"
+            coordinates, pages = self._processor.parse_tei(text)
+            if self._processor.cache is not None:
+                self._processor.save_result(key, text, coordinates, pages)
+
+        output_path = self.write_output(input_path, file_hash, coordinates, pages)
+        self._journal.write(
+            path=input_path,
+            hash=file_hash,
+            status="done",
+            output=output_path,
+            seconds=round(time.time() - start, 3),
+        )
+        return "done"
+
+    def run(self, input_paths):
+        counts = {"done": 0, "skipped": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=self._n) as executor:
+            # submit by batches so that the pending futures stay bounded
+            for i in range(0, len(input_paths), self._batch_size):
+                batch = input_paths[i : i + self._batch_size]
+                for input_path, outcome in zip(
+                    batch, executor.map(self.process_file, batch)
+                ):
+                    counts[outcome] += 1
+                    print(f"[{outcome}] {input_path}")
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input", help="directory of PDFs or manifest file")
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--config", default="./config.json")
+    parser.add_argument(
+        "--servers", default=None, help="comma separated GROBID URLs"
+    )
+    parser.add_argument("--n", type=int, default=10, help="concurrent requests")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument(
+        "--cache", default=None, help="GROBID cache shared with the application"
+    )
+    args = parser.parse_args()
+
+    # with --servers, the config file is optional
+    config = {}
+    if not args.servers or os.path.exists(args.config):
+        config = load_config(args.config)
+    grobid_client = GrobidPool.from_config(args.config, servers=args.servers)
+    cache = DiskCache(args.cache) if args.cache else None
+    batch = BatchProcessor(
+        GrobidProcessor(grobid_client, cache=cache),
+        args.output,
+        n=args.n,
+        batch_size=config.get("batch_size", 1000),
+        sleep_time=config.get("sleep_time", 5),
+        max_retries=args.max_retries,
+    )
+
+    start = time.time()
+    counts = batch.run(list_inputs(args.input))
+    print(
+        f"{counts['done']} processed, {counts['skipped']} skipped, "
+        f"{counts['failed']} failed in {time.time() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,13 @@
+import json
+import zlib
+from hashlib import blake2b
+from io import BytesIO
+
+import fitz
 from bs4 import BeautifulSoup
+from lxml import etree
+
+from src.tracing import traced, tracer
 
 COLORS = {
     "persName": "rgba(0, 0, 255, 1)",  # Blue
@@ -13,6 +22,33 @@ COLORS = {
     "affiliation": "rgba(255, 165, 0, 1)",  # red-orengi
 }
 
+GROBID_SERVICE = "processFulltextDocument"
+
+GROBID_OPTIONS = {
+    "consolidate_header": True,
+    "consolidate_citations": False,
+    "segment_sentences": True,
+    "tei_coordinates": True,
+    "include_raw_citations": False,
+    "include_raw_affiliations": False,
+    "generateIDs": True,
+}
+
+# the full text of the first page, in a second or two: processHeaderDocument
+# gives no coordinates, and the slow consolidation is left to the whole text
+HEADER_OPTIONS = {**GROBID_OPTIONS, "consolidate_header": False, "start": 1, "end": 1}
+
+# GROBID form fields of the client's options
+GROBID_FIELDS = {
+    "consolidate_header": "consolidateHeader",
+    "consolidate_citations": "consolidateCitations",
+    "segment_sentences": "segmentSentences",
+    "tei_coordinates": "teiCoordinates",
+    "include_raw_citations": "includeRawCitations",
+    "include_raw_affiliations": "includeRawAffiliations",
+    "generateIDs": "generateIDs",
+}
+
 
 def get_color(name, param):
     color = COLORS[name] if name in COLORS else "rgba(128, 128, 128, 1.0)"
@@ -22,30 +58,200 @@ def get_color(name, param):
     return color
 
 
+def get_form_data(options, coordinates):
+    # same form as GrobidClient.process_pdf sends, the start and end pages too
+    data = {}
+    for option, value in options.items():
+        if option not in GROBID_FIELDS:
+            data[option] = str(value)
+        elif not value:
+            continue
+        elif option == "tei_coordinates":
+            data[GROBID_FIELDS[option]] = list(coordinates or [])
+        else:
+            data[GROBID_FIELDS[option]] = "1"
+    return data
+
+
+def get_name(element):
+    # BeautifulSoup's xml builder names the elements without their namespace
+    return element.tag.rpartition("}")[2]
+
+
+# what BeautifulSoup counts as whitespace
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def get_string(text):
+    # BeautifulSoup collapses a whitespace only string, e.g. the indentation
+    # of GROBID's output, to one newline or one space
+    if not text or text.strip(ASCII_SPACES):
+        return text or ""
+    return "\n" if "\n" in text else " "
+
+
+def get_file_hash(fname):
+    hash_md5 = blake2b()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
 class GrobidProcessor:
-    def __init__(self, grobid_client):
+    def __init__(self, grobid_client, cache=None, ocr=None):
         self.grobid_client = grobid_client
+        self.cache = cache
+        # reads the pages without text layer, see src.ocr.OCRFallback
+        self.ocr = ocr
 
-    def process_structure(self, input_path):
-        pdf_file, status, text = self.grobid_client.process_pdf(
-            "processFulltextDocument",
-            input_path,
-            consolidate_header=True,
-            consolidate_citations=False,
-            segment_sentences=True,
-            tei_coordinates=True,
-            include_raw_citations=False,
-            include_raw_affiliations=False,
-            generateIDs=True,
-        )
+    @property
+    def config(self):
+        return getattr(self.grobid_client, "config", {})
+
+    def cache_key(self, file_hash, options=GROBID_OPTIONS, chunk_pages=None):
+        # GROBID's result depends on the options and the elements asked with
+        # coordinates; the OCR is cached per page, apart, so the batch and the
+        # application share the entries whether they read textless pages or not
+        params = [GROBID_SERVICE, options, self.config.get("coordinates")]
+        if chunk_pages:
+            params.append(chunk_pages)
+        digest = blake2b(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return f"{file_hash}:{digest.hexdigest()[:16]}"
+
+    def request_tei(self, input_path, service=GROBID_SERVICE, **options):
+        with tracer.span("grobid.request", service=service) as span:
+            pdf_file, status, text = self.grobid_client.process_pdf(
+                service, input_path, **{**GROBID_OPTIONS, **options}
+            )
+            span.set(status=status, bytes=len(text or ""))
+        return status, text
+
+    @staticmethod
+    def get_page_ranges(input_path, chunk_pages):
+        # 1-based and inclusive, as GROBID's start and end
+        with fitz.open(input_path) as doc:
+            page_count = doc.page_count
+        return [
+            (start, min(start + chunk_pages - 1, page_count))
+            for start in range(1, page_count + 1, chunk_pages)
+        ]
+
+    def request_chunks(self, input_path, chunk_pages, on_chunk=None):
+        """Full text of ``chunk_pages`` pages at a time, one request each.
 
+        Return ``(status, coordinates, pages)`` for the whole document, the
+        first failing status if any. ``on_chunk(coordinates, last page, page
+        count)`` is called with the coordinates so far after each range.
+        """
+        ranges = self.get_page_ranges(input_path, chunk_pages)
+        coordinates, pages = [], []
+        for start, end in ranges:
+            status, text = self.request_tei(input_path, start=start, end=end)
+            if status != 200:
+                return status, [], []
+            chunk_coordinates, chunk_pages_sizes = self.parse_tei(text)
+            first = min((int(c["page"]) for c in chunk_coordinates), default=start)
+            if first < start:
+                # the range was numbered from 1
+                for coordinate in chunk_coordinates:
+                    coordinate["page"] = str(int(coordinate["page"]) + start - 1)
+            coordinates.extend(chunk_coordinates)
+            pages.extend(chunk_pages_sizes)
+            if on_chunk is not None:
+                on_chunk(coordinates, end, ranges[-1][1])
+        return 200, coordinates, pages
+
+    def load_result(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        return json.loads(zlib.decompress(cached))
+
+    def save_result(self, key, text, coordinates, pages):
+        result = {"tei": text, "coordinates": coordinates, "pages": pages}
+        self.cache.set(key, zlib.compress(json.dumps(result).encode("utf-8")))
+
+    @traced("grobid.process_header")
+    def process_header(self, input_path, file_hash=None):
+        """Return the first page's ``{"tei", "coordinates", "pages"}``: title,
+        authors and affiliations, long before the full text. None when GROBID
+        fails."""
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(
+                file_hash or get_file_hash(input_path), HEADER_OPTIONS
+            )
+            result = self.load_result(key)
+            if result is not None:
+                return result
+
+        status, text = self.request_tei(input_path, **HEADER_OPTIONS)
         if status != 200:
             return
+        coordinates, pages = self.parse_tei(text)
+
+        if key is not None:
+            self.save_result(key, text, coordinates, pages)
+
+        return {"tei": text, "coordinates": coordinates, "pages": pages}
+
+    @traced("grobid.process_document")
+    def process_document(
+        self, input_path, file_hash=None, chunk_pages=None, on_chunk=None
+    ):
+        """Return ``{"tei", "coordinates", "pages"}``, or None when GROBID
+        fails and there is no OCR to fall back on.
 
-        coordinates = self.get_coordinates(text)
-        pages = self.get_pages(text)
+        With ``chunk_pages``, the full text is requested by ranges of pages,
+        see ``request_chunks``; there is no TEI for the whole document then.
+        The cache holds GROBID's result, the OCR of the textless pages is
+        added to it on every call, from the OCR's own cache.
+        """
+        result = None
+        if self.cache is not None:
+            key = self.cache_key(
+                file_hash or get_file_hash(input_path), chunk_pages=chunk_pages
+            )
+            result = self.load_result(key)
 
-        return coordinates, len(pages)
+        if result is None:
+            if chunk_pages:
+                status, coordinates, pages = self.request_chunks(
+                    input_path, chunk_pages, on_chunk
+                )
+                text = None
+            else:
+                status, text = self.request_tei(input_path)
+                if status == 200:
+                    coordinates, pages = self.parse_tei(text)
+            if status == 200:
+                result = {"tei": text, "coordinates": coordinates, "pages": pages}
+                if self.cache is not None:
+                    self.save_result(key, text, coordinates, pages)
+
+        if self.ocr is None:
+            return result
+
+        # GROBID's annotations, or none when it failed, and the OCR's
+        try:
+            coordinates = list(result["coordinates"]) if result else []
+            coordinates.extend(self.ocr.process(input_path))
+            pages = result["pages"] if result else []
+            pages = pages or self.ocr.get_pages(input_path)
+        except Exception as e:
+            # e.g. Tesseract is not installed, GROBID's annotations stand
+            print(f"OCR failed: {e}")
+            return result
+
+        text = result["tei"] if result else None
+        return {"tei": text, "coordinates": coordinates, "pages": pages}
+
+    def process_structure(self, input_path, file_hash=None):
+        result = self.process_document(input_path, file_hash)
+        if result is None:
+            return
+        return result["coordinates"], len(result["pages"])
 
     @staticmethod
     def box_to_dict(box, text, color=None, type=None):
@@ -66,6 +272,7 @@ class GrobidProcessor:
 
         return item
 
+    @traced("grobid.get_coordinates")
     def get_coordinates(self, text):
         soup = BeautifulSoup(text, "xml")
         all_blocks_with_coordinates = soup.find_all(coords=True)
@@ -87,6 +294,7 @@ class GrobidProcessor:
             count += 1
         return coordinates
 
+    @traced("grobid.get_pages")
     def get_pages(self, text):
         soup = BeautifulSoup(text, "xml")
         pages_infos = soup.find_all("surface")
@@ -100,3 +308,90 @@ class GrobidProcessor:
         ]
 
         return pages
+
+    @traced("grobid.parse_tei")
+    def parse_tei(self, text):
+        """Extract the coordinates and the page sizes of a TEI document in one pass.
+
+        The output is identical to ``get_coordinates`` and ``get_pages``: blocks
+        are listed in document order and each block carries the concatenation of
+        all the strings it contains, whitespace only strings collapsed as
+        BeautifulSoup does. Elements are dropped from the tree as soon
+        as they are not needed anymore.
+        """
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+
+        coordinates = []
+        pages = []
+        # one entry per open element: the texts of its closed children, or None
+        # when no element with coordinates needs the text
+        stack = []
+        # one entry per open element: the boxes waiting for the element's text
+        pending = []
+        opened = 0
+        count = 0
+
+        events = etree.iterparse(
+            BytesIO(text),
+            events=("start", "end"),
+            remove_comments=True,
+            remove_pis=True,
+            huge_tree=True,
+        )
+        for event, element in events:
+            if event == "start":
+                coords = element.get("coords")
+                name = get_name(element)
+                boxes = None
+                if coords is not None:
+                    color = get_color(name, count % 2 == 0)
+                    boxes = [
+                        self.box_to_dict(box.split(","), None, color, type=name)
+                        for box in coords.split(";")
+                        if len(box) > 0 and box[0] != ""
+                    ]
+                    coordinates.extend(boxes)
+                    count += 1
+                    opened += 1
+                if name == "surface":
+                    pages.append(
+                        {
+                            "width": float(element.get("lrx"))
+                            - float(element.get("ulx")),
+                            "height": float(element.get("lry"))
+                            - float(element.get("uly")),
+                        }
+                    )
+                stack.append([] if opened > 0 else None)
+                pending.append(boxes)
+                continue
+
+            children_texts = stack.pop()
+            boxes = pending.pop()
+            parent_texts = stack[-1] if stack else None
+
+            if children_texts is not None:
+                parts = [get_string(element.text)]
+                for child, child_text in zip(element, children_texts):
+                    parts.append(child_text)
+                    parts.append(get_string(child.tail))
+                full_text = "".join(parts)
+                if boxes is not None:
+                    for box in boxes:
+                        box["text"] = full_text
+                    opened -= 1
+                if parent_texts is not None:
+                    parent_texts.append(full_text)
+
+            if parent_texts is not None:
+                # the parent still needs our tail, only our children can go
+                del element[:]
+            else:
+                element.clear()
+                parent = element.getparent()
+                if parent is not None:
+                    while element.getprevious() is not None:
+                        del parent[0]
+
+        return coordinates, pages
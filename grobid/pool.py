@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import time
+
+import httpx
+
+from grobid.grobid_processor import get_form_data
+
+# statuses telling the server, not the document, is at fault
+FAILURE_STATUSES = (408, 500, 502, 503, 504)
+
+# config.json's, for a deployment giving the servers without the file
+DEFAULT_CONFIG = {
+    "sleep_time": 5,
+    "timeout": 60,
+    "coordinates": [
+        "p",
+        "s",
+        "persName",
+        "biblStruct",
+        "figure",
+        "formula",
+        "head",
+        "note",
+        "title",
+        "ref",
+        "affiliation",
+    ],
+}
+
+
+class Endpoint:
+    def __init__(self, url) -> None:
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.failures = 0
+        # the circuit is open, no request is routed here, until then
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.latency = None
+        self.total_time = 0.0
+
+    def is_available(self, now):
+        return self.healthy and now >= self.open_until
+
+    def record(self, elapsed, failed, failure_threshold, open_seconds):
+        self.requests += 1
+        self.total_time += elapsed
+        # moving average of the latency, a few requests react to a slowdown
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * elapsed
+        if failed:
+            self.errors += 1
+            self.failures += 1
+            if self.failures >= failure_threshold:
+                self.open_until = time.monotonic() + open_seconds
+        else:
+            self.failures = 0
+            self.open_until = 0.0
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "open": self.open_until > time.monotonic(),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency": self.latency,
+            "mean_latency": self.total_time / self.requests if self.requests else None,
+        }
+
+
+class GrobidPool:
+    """GrobidClient over several GROBID servers.
+
+    Each document goes to the available server with the fewest requests in
+    flight, the fastest one on a tie. A server failing ``failure_threshold``
+    times in a row is left out for ``open_seconds``, then given a request
+    again; a background thread checks ``isalive`` every ``check_interval``
+    seconds and takes the servers down or back accordingly.
+
+    Exposes ``config`` and ``process_pdf`` as GrobidClient does, to sit behind
+    GrobidProcessor, but posts the form itself: GrobidClient retries a 503
+    for as long as it lasts, the pool's breaker and the callers' backoff see
+    it instead.
+    """
+
+    def __init__(
+        self,
+        servers,
+        config: dict = None,
+        check_interval: float = 10,
+        failure_threshold: int = 3,
+        open_seconds: float = 30,
+        check_server: bool = True,
+    ) -> None:
+        self.config = {**(config or {}), "grobid_servers": list(servers)}
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self.endpoints = [Endpoint(url) for url in servers]
+        self._http = httpx.Client(timeout=5)
+        # shared by the threads, a pool of connections per server
+        self._client = httpx.Client(
+            timeout=httpx.Timeout(self.config.get("timeout", 60), connect=10)
+        )
+        self._stopped = threading.Event()
+        if check_server:
+            self.check_health()
+        self._checker = threading.Thread(target=self.check_forever, daemon=True)
+        self._checker.start()
+
+    @classmethod
+    def from_config(cls, config_path="./config.json", servers=None, **kwargs):
+        """``servers``, or ``grobid_servers`` or ``grobid_server`` of the
+        config, may list several comma separated URLs. With ``servers``, the
+        config file is optional: ``DEFAULT_CONFIG`` stands in for it."""
+        config = dict(DEFAULT_CONFIG)
+        if not servers or os.path.exists(config_path):
+            with open(config_path, "r") as fr:
+                config.update(json.load(fr))
+        servers = servers or config.get("grobid_servers") or config["grobid_server"]
+        if isinstance(servers, str):
+            servers = [url.strip() for url in servers.split(",") if url.strip()]
+        kwargs.setdefault("check_server", config.get("check_server", True))
+        return cls(servers, config, **kwargs)
+
+    def is_alive(self, endpoint):
+        try:
+            response = self._http.get(endpoint.url.rstrip("/") + "/api/isalive")
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            alive = self.is_alive(endpoint)
+            with self._lock:
+                if alive and not endpoint.healthy:
+                    # re-admitted with a clean slate
+                    endpoint.failures = 0
+                    endpoint.open_until = 0.0
+                endpoint.healthy = alive
+
+    def check_forever(self):
+        while not self._stopped.wait(self._check_interval):
+            self.check_health()
+
+    def close(self):
+        self._stopped.set()
+        self._http.close()
+        self._client.close()
+
+    def available(self):
+        now = time.monotonic()
+        return [endpoint for endpoint in self.endpoints if endpoint.is_available(now)]
+
+    def acquire(self):
+        with self._lock:
+            candidates = self.available()
+            if not candidates:
+                return None
+            endpoint = min(
+                candidates,
+                key=lambda e: (e.outstanding, e.latency or 0.0),
+            )
+            endpoint.outstanding += 1
+            if endpoint.open_until:
+                # half open: one request tries the server again
+                endpoint.open_until = time.monotonic() + self._open_seconds
+            return endpoint
+
+    def release(self, endpoint, elapsed, failed):
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.record(
+                elapsed, failed, self._failure_threshold, self._open_seconds
+            )
+
+    def post(self, endpoint, service, pdf_file, **options):
+        """Send the document to ``endpoint``, return ``(status, text)``.
+
+        ``options`` are GrobidClient's and the ``start`` and ``end`` pages.
+        The status is None when the server cannot be reached.
+        """
+        if isinstance(pdf_file, (bytes, bytearray, memoryview)):
+            name, content = "document.pdf", bytes(pdf_file)
+        else:
+            name = os.path.basename(pdf_file)
+            with open(pdf_file, "rb") as f:
+                content = f.read()
+        data = get_form_data(options, self.config.get("coordinates"))
+        try:
+            response = self._client.post(
+                f"{endpoint.url.rstrip('/')}/api/{service}",
+                files={"input": (name, content, "application/pdf")},
+                data=data,
+                headers={"Accept": "text/plain"},
+            )
+        except httpx.TimeoutException:
+            return 408, None
+        except httpx.TransportError as e:
+            print(f"Request to {endpoint.url} failed: {e}")
+            return None, None
+        return response.status_code, response.text
+
+    def process_pdf(self, service, pdf_file, **options):
+        endpoint = self.acquire()
+        if endpoint is None:
+            # what a saturated server answers, callers retry it
+            return pdf_file, 503, "No GROBID server available"
+        start = time.perf_counter()
+        failed = True
+        try:
+            status, text = self.post(endpoint, service, pdf_file, **options)
+            failed = status is None or status in FAILURE_STATUSES
+            return pdf_file, status, text
+        finally:
+            self.release(endpoint, time.perf_counter() - start, failed)
+
+    def stats(self):
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+
+
+class TimedStream:
+    """Iterate over the tokens of a generation, timing the first one."""
+
+    def __init__(self, tokens) -> None:
+        self._tokens = iter(tokens)
+        self._start = time.perf_counter()
+        self.ttft = None
+        self.elapsed = None
+        self.count = 0
+
+    def __iter__(self):
+        for token in self._tokens:
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self._start
+            self.count += 1
+            yield token
+        self.elapsed = time.perf_counter() - self._start
+
+    def report(self):
+        if self.ttft is None:
+            return "no output"
+        report = f"first token in {self.ttft * 1000:.0f} ms"
+        if self.elapsed:
+            report += f", {self.count} chunks in {self.elapsed:.1f} s"
+        return report
+
+
+class LLMBackend:
+    """Completion of a raw prompt, streamed token by token.
+
+    ``params`` are the sidebar's: temperature, top_p, max_length and
+    repetition_penalty. Each backend maps them to its own API.
+    """
+
+    name = None
+
+    @property
+    def model_id(self):
+        raise NotImplementedError
+
+    def generate(self, prompt, params):
+        raise NotImplementedError
+
+    def generate_background(self, prompt, params):
+        """``generate`` for a request nobody waits for, e.g. a prefetch."""
+        return self.generate(prompt, params)
+
+
+class ReplicateBackend(LLMBackend):
+    name = "Replicate"
+
+    def __init__(self, model, api_token=None) -> None:
+        import replicate
+
+        self._model = model
+        # one client, one pool of connections
+        self._client = replicate.Client(api_token=api_token)
+
+    @property
+    def model_id(self):
+        return f"replicate:{self._model}"
+
+    def generate(self, prompt, params):
+        for event in self._client.stream(
+            self._model, input={"prompt": prompt, **params}
+        ):
+            token = str(event)
+            if token:
+                yield token
+
+
+class OpenAIBackend(LLMBackend):
+    """Any OpenAI-compatible server, e.g. llama.cpp's on localhost:8080."""
+
+    name = "OpenAI-compatible"
+
+    def __init__(self, base_url, model, api_key=None) -> None:
+        from openai import OpenAI
+
+        self._base_url = base_url
+        self._model = model
+        self._client = OpenAI(base_url=base_url, api_key=api_key or "none")
+
+    @property
+    def model_id(self):
+        return f"openai:{self._base_url}:{self._model}"
+
+    def generate(self, prompt, params):
+        response = self._client.completions.create(
+            model=self._model,
+            prompt=prompt,
+            max_tokens=params.get("max_length"),
+            temperature=params.get("temperature"),
+            top_p=params.get("top_p"),
+            stream=True,
+        )
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].text:
+                    yield chunk.choices[0].text
+        finally:
+            response.close()
+
+
+class Preempted(Exception):
+    pass
+
+
+class LlamaCppBackend(LLMBackend):
+    """A GGUF model run in process by llama-cpp-python.
+
+    The context runs one generation at a time, start to end. The answers a
+    user waits for go first: a background generation waits for them, and
+    stops at the next token when one comes in.
+    """
+
+    name = "llama.cpp"
+
+    def __init__(self, model_path, n_ctx: int = 2048) -> None:
+        from llama_cpp import Llama
+
+        self._model_path = model_path
+        self._model = Llama(model_path=model_path, n_ctx=n_ctx, verbose=False)
+        # a context serves one generation at a time
+        self._lock = threading.Lock()
+        # the foreground generations waiting for the lock
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    @property
+    def model_id(self):
+        return f"llama_cpp:{os.path.basename(self._model_path)}"
+
+    def complete(self, prompt, params, background=False):
+        chunks = self._model.create_completion(
+            prompt,
+            max_tokens=params.get("max_length"),
+            temperature=params.get("temperature", 0.8),
+            top_p=params.get("top_p", 0.95),
+            repeat_penalty=params.get("repetition_penalty", 1.1),
+            stream=True,
+        )
+        try:
+            for chunk in chunks:
+                if background and self._waiting:
+                    # raised, not returned, a partial answer is not cached
+                    raise Preempted("Stopped for a foreground generation")
+                text = chunk["choices"][0]["text"]
+                if text:
+                    yield text
+        finally:
+            chunks.close()
+
+    def generate(self, prompt, params):
+        with self._condition:
+            self._waiting += 1
+        try:
+            self._lock.acquire()
+        finally:
+            with self._condition:
+                self._waiting -= 1
+                self._condition.notify_all()
+        try:
+            yield from self.complete(prompt, params)
+        finally:
+            self._lock.release()
+
+    def generate_background(self, prompt, params):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._waiting)
+            # a foreground generation may come in between, it preempts us
+            if self._lock.acquire(timeout=0.1):
+                break
+        try:
+            yield from self.complete(prompt, params, background=True)
+        finally:
+            self._lock.release()
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (ReplicateBackend, OpenAIBackend, LlamaCppBackend)
+}
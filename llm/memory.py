@@ -0,0 +1,139 @@
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+
+# words and punctuation, llama's tokenizer splits words into ~1.3 pieces
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(PIECE_PATTERN.findall(text)) * 1.3)
+
+
+def get_token_counter(model_path=None):
+    """Token count of the model's tokenizer, or an estimate without a model."""
+    if model_path and os.path.exists(model_path):
+        try:
+            from llama_cpp import Llama
+
+            # the vocabulary only, no weights
+            model = Llama(model_path=model_path, vocab_only=True, verbose=False)
+
+            def count_tokens(text):
+                return len(model.tokenize(text.encode("utf-8"), add_bos=False))
+
+            return lru_cache(maxsize=4096)(count_tokens)
+        except Exception as e:
+            print(f"Falling back to estimated token counts: {e}")
+    return lru_cache(maxsize=4096)(estimate_tokens)
+
+
+def format_message(message):
+    role = "User" if message["role"] == "user" else "Assistant"
+    return f"{role}: {message['content']}"
+
+
+def extractive_summary(summary, messages):
+    # the first sentence of each turn, when no model summarizes
+    sentences = [summary] if summary else []
+    for message in messages:
+        first = re.split(r"(?<=[.!?])\s", message["content"].strip(), maxsplit=1)[0]
+        sentences.append(format_message({**message, "content": first}))
+    return "\n".join(sentences)
+
+
+class ConversationMemory:
+    """Recent turns within a token budget, older ones folded into a summary.
+
+    The window is the longest run of last messages that fits in ``budget``
+    tokens. Messages leaving the window are folded once into the summary,
+    with ``summarize(summary, messages)``, so every turn costs the same
+    whatever the length of the conversation. ``get_context`` never waits for
+    the model: ``fold`` is meant to run after the answer, e.g. in a thread,
+    and until then the messages out of the window are summarized
+    extractively.
+    """
+
+    def __init__(
+        self,
+        count_tokens,
+        budget: int = 256,
+        summary_budget: int = 96,
+        summarize=None,
+    ) -> None:
+        self._count_tokens = count_tokens
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self._summarize = summarize or extractive_summary
+        self.summary = ""
+        # messages[:folded] are in the summary
+        self.folded = 0
+        # changes with every reset and fold, a fold started before is stale
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self.folded = 0
+            self._version += 1
+
+    def get_window_start(self, messages):
+        used = 0
+        start = len(messages)
+        while start > self.folded:
+            used += self._count_tokens(format_message(messages[start - 1]))
+            if used > self.budget:
+                break
+            start -= 1
+        return start
+
+    def truncate(self, text):
+        # keeps the end, the latest turns matter more
+        while text and self._count_tokens(text) > self.summary_budget:
+            text = text.split("\n", 1)[1] if "\n" in text else text[len(text) // 4 :]
+        return text
+
+    def get_context(self, messages):
+        """Return ``(summary, recent messages)`` for the prompt."""
+        with self._lock:
+            if self.folded > len(messages):
+                # the history was cleared
+                self.reset()
+            start = self.get_window_start(messages)
+            summary = self.summary
+            if start > self.folded:
+                # not folded yet
+                summary = self.truncate(
+                    extractive_summary(summary, messages[self.folded : start])
+                )
+            return summary, messages[start:]
+
+    def fold(self, messages, summarize=None):
+        """Fold the messages out of the window into the summary. ``summarize``
+        stands in for the memory's own, e.g. to use the current model.
+
+        Return False when there was nothing to fold, or the history changed
+        meanwhile.
+        """
+        with self._lock:
+            if self.folded > len(messages):
+                self.reset()
+            folded, summary, version = self.folded, self.summary, self._version
+            start = self.get_window_start(messages)
+        if start <= folded:
+            return False
+        try:
+            summary = (summarize or self._summarize)(summary, messages[folded:start])
+        except Exception as e:
+            print(f"Summarization failed, extracting instead: {e}")
+            summary = extractive_summary(summary, messages[folded:start])
+        with self._lock:
+            if self._version != version:
+                return False
+            self.summary = self.truncate(summary.strip())
+            self.folded = start
+            self._version += 1
+        return True
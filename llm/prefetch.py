@@ -0,0 +1,52 @@
+import threading
+
+
+class Prefetcher:
+    """Answers requested ahead of the clicks, for the response cache.
+
+    The requests of a session run on a shared executor, which bounds the
+    concurrency, and at most ``max_requests`` are sent per ``start``. A
+    cancelled request stops reading its stream, so nothing partial is cached.
+    """
+
+    def __init__(self, executor, max_requests: int = 8) -> None:
+        self._executor = executor
+        self._max_requests = max_requests
+        self._cancelled = threading.Event()
+        self._futures = []
+
+    def start(self, prompts, complete):
+        """Run ``complete(prompt)``, an iterator of tokens, for the first
+        ``max_requests`` of ``prompts``."""
+        self.cancel()
+        self._cancelled = threading.Event()
+        self._futures = [
+            self._executor.submit(self.consume, complete, prompt, self._cancelled)
+            for prompt in prompts[: self._max_requests]
+        ]
+
+    @staticmethod
+    def consume(complete, prompt, cancelled):
+        if cancelled.is_set():
+            return False
+        tokens = complete(prompt)
+        try:
+            for _ in tokens:
+                if cancelled.is_set():
+                    return False
+        except Exception as e:
+            print(f"Prefetch failed: {e}")
+            return False
+        finally:
+            tokens.close()
+        return True
+
+    def cancel(self):
+        self._cancelled.set()
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+
+    @property
+    def pending(self):
+        return sum(not future.done() for future in self._futures)
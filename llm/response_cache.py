@@ -0,0 +1,55 @@
+import json
+from hashlib import blake2b
+
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.split())
+
+
+class ResponseCache:
+    """Answers of the model shared by all the sessions, on a DiskCache.
+
+    Only the requests sampled at a low temperature are cached: above
+    ``max_temperature`` the same prompt is expected to give other answers.
+    """
+
+    def __init__(self, cache, max_temperature: float = 0.3) -> None:
+        self._cache = cache
+        self._max_temperature = max_temperature
+
+    def is_cacheable(self, params):
+        return params.get("temperature", 1.0) <= self._max_temperature
+
+    def cache_key(self, model, params, prompt):
+        digest = blake2b(
+            json.dumps(
+                [model, sorted(params.items()), normalize_prompt(prompt)]
+            ).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        return f"llm:{digest}"
+
+    def get(self, model, params, prompt):
+        if not self.is_cacheable(params):
+            return None
+        value = self._cache.get(self.cache_key(model, params, prompt))
+        return None if value is None else value.decode("utf-8")
+
+    def set(self, model, params, prompt, text):
+        if self.is_cacheable(params) and text:
+            self._cache.set(
+                self.cache_key(model, params, prompt), text.encode("utf-8")
+            )
+
+    def stream(self, model, params, prompt, generate):
+        """Yield the cached answer at once, or the tokens of ``generate()``,
+        stored when the answer is complete."""
+        cached = self.get(model, params, prompt)
+        if cached is not None:
+            yield cached
+            return
+        tokens = []
+        for token in generate():
+            tokens.append(token)
+            yield token
+        self.set(model, params, prompt, "".join(tokens))
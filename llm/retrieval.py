@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# GROBID elements indexed by default; sentences ("s") are parts of the
+# paragraphs and only worth indexing when paragraphs are not extracted
+RETRIEVAL_TYPES = ("head", "p")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """Bag of words embeddings by feature hashing, no model needed."""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024) -> None:
+        self._dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                digest = zlib.crc32(token.encode("utf-8"))
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[i, (digest >> 1) % self._dim] += sign
+        return vectors
+
+
+class LlamaEmbedder:
+    """Embeddings of a local GGUF model through llama-cpp-python."""
+
+    def __init__(self, model_path, n_ctx: int = 512) -> None:
+        from llama_cpp import Llama
+
+        self.name = os.path.splitext(os.path.basename(model_path))[0]
+        self._model = Llama(
+            model_path=model_path, embedding=True, n_ctx=n_ctx, verbose=False
+        )
+        # the context is not thread safe, the prefetches share it with the chat
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            with self._lock:
+                embedding = self._model.embed(text)
+            vector = np.asarray(embedding, dtype=np.float32)
+            if vector.ndim == 2:
+                # one vector per token when the model does no pooling
+                vector = vector.mean(axis=0)
+            vectors.append(vector)
+        return np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+def get_embedder(model_path=None):
+    if model_path and os.path.exists(model_path):
+        try:
+            return LlamaEmbedder(model_path)
+        except Exception as e:
+            print(f"Falling back to hashing embeddings: {e}")
+    return HashingEmbedder()
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class ChunkIndex:
+    """Top-k search over the text segments of one document."""
+
+    def __init__(self, texts, types, vectors) -> None:
+        self.texts = list(texts)
+        self.types = list(types)
+        self.vectors = normalize(np.asarray(vectors, dtype=np.float32))
+
+    @classmethod
+    def build(cls, store, embedder, types=RETRIEVAL_TYPES):
+        texts, chunk_types, seen = [], [], set()
+        indices = store.select([type for type in types if type in store.types])
+        # the boxes of an element share their text code
+        for code, type in zip(
+            store.text_codes[indices].tolist(), store.type_codes[indices].tolist()
+        ):
+            text = store.texts[code].strip()
+            if len(text) > 5 and text not in seen:
+                seen.add(text)
+                texts.append(text)
+                chunk_types.append(store.types[type])
+        vectors = embedder.embed(texts) if texts else np.zeros((0, 1))
+        return cls(texts, chunk_types, vectors)
+
+    @staticmethod
+    def get_path(index_dir, doc_hash, embedder):
+        return os.path.join(index_dir, f"{doc_hash}-{embedder.name}.npz")
+
+    @classmethod
+    def load_or_build(cls, index_dir, doc_hash, store, embedder, types=RETRIEVAL_TYPES):
+        path = cls.get_path(index_dir, doc_hash, embedder)
+        if os.path.exists(path):
+            return cls.load(path)
+        index = cls.build(store, embedder, types)
+        index.save(path)
+        return index
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            texts=np.array(self.texts, dtype=str),
+            types=np.array(self.types, dtype=str),
+            vectors=self.vectors,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["texts"].tolist(), data["types"].tolist(), data["vectors"])
+
+    def __len__(self):
+        return len(self.texts)
+
+    def search(self, query, embedder, k: int = 3):
+        if not self.texts:
+            return []
+        query = normalize(embedder.embed([query]))[0]
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.texts[i], self.types[i]) for i in top]
+
+
+def build_prompt(
+    system,
+    question,
+    passages,
+    history,
+    summary: str = "",
+    max_passage_chars: int = 600,
+):
+    """Prompt made of the retrieved passages, the summary of the earlier
+    conversation and the recent turns."""
+    prompt = system
+    if passages:
+        context = "\n\n".join(text[:max_passage_chars] for _, text, _ in passages)
+        prompt += f"\n\nUse the following excerpts of the paper:\n{context}\n\n"
+    if summary:
+        prompt += f"Summary of the conversation so far:\n{summary}\n\n"
+    for message in history:
+        if message["role"] == "user":
+            prompt += "User: " + message["content"] + "\n\n"
+        else:
+            prompt += "Assistant: " + message["content"] + "\n\n"
+    return f"{prompt} {question} Assistant: "
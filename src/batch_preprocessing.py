@@ -0,0 +1,124 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.preprocessing import ImageProcessor
+from src.workers import get_mp_context
+
+
+def process_frame(frame, out, preprocess_params, segment_params):
+    """Worker side: preprocess the page in place of ``out``, return the regions."""
+    in_memory = shared_memory.SharedMemory(name=frame[0])
+    out_memory = shared_memory.SharedMemory(name=out[0])
+    try:
+        image = np.ndarray(frame[1], dtype=np.uint8, buffer=in_memory.buf)
+        preprocessed = np.ndarray(out[1], dtype=np.uint8, buffer=out_memory.buf)
+        processor = ImageProcessor(image=image, channels=frame[2])
+        processor.preprocess(**preprocess_params, out=preprocessed)
+        dilate = processor.get_dilate(
+            segment_params["dilation_shape"],
+            segment_params["iterations"],
+            in_image=preprocessed,
+        )
+        _, roi = processor.get_segment(
+            dilate,
+            segment_params["h_thresh"],
+            segment_params["w_thresh"],
+            in_image=preprocessed,
+        )
+        # the boxes only, the pixels stay in shared memory
+        boxes = [box for _, box in roi]
+        del image, preprocessed, processor, dilate, roi
+        return boxes
+    finally:
+        in_memory.close()
+        out_memory.close()
+
+
+class BatchPreprocessor:
+    """Preprocess and segment pages on a pool of processes.
+
+    Pages are copied once into shared memory, where the workers read them and
+    write the preprocessed image back, so no pixel goes through pickle. The
+    results come out in page order as soon as they are ready.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        preprocess_params: dict = None,
+        dilation_shape: tuple = (13, 13),
+        iterations: int = 5,
+        h_thresh: int = 0,
+        w_thresh: int = 0,
+    ) -> None:
+        self._workers = workers or os.cpu_count()
+        self._preprocess_params = preprocess_params or {}
+        self._segment_params = {
+            "dilation_shape": dilation_shape,
+            "iterations": iterations,
+            "h_thresh": h_thresh,
+            "w_thresh": w_thresh,
+        }
+
+    @staticmethod
+    def share(image):
+        memory = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        frame = np.ndarray(image.shape, dtype=np.uint8, buffer=memory.buf)
+        np.copyto(frame, image)
+        del frame
+        return memory
+
+    @staticmethod
+    def release(*memories):
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+    def run(self, pages, channels: str = "RGB"):
+        """Yield ``(page number, preprocessed image, boxes)`` for each
+        ``(page number, image)`` of ``pages``, e.g. ``Pager.rasterize()``."""
+        pending = deque()
+        with ProcessPoolExecutor(
+            max_workers=self._workers, mp_context=get_mp_context()
+        ) as executor:
+            try:
+                for number, image in pages:
+                    in_memory = self.share(image)
+                    out_shape = image.shape[:2]
+                    out_memory = shared_memory.SharedMemory(
+                        create=True, size=max(int(np.prod(out_shape)), 1)
+                    )
+                    future = executor.submit(
+                        process_frame,
+                        (in_memory.name, image.shape, channels),
+                        (out_memory.name, out_shape),
+                        self._preprocess_params,
+                        self._segment_params,
+                    )
+                    pending.append(
+                        (number, in_memory, out_memory, out_shape, future)
+                    )
+                    # bounds the frames held in shared memory
+                    if len(pending) >= 2 * self._workers:
+                        yield self.collect(pending.popleft())
+                while pending:
+                    yield self.collect(pending.popleft())
+            finally:
+                for number, in_memory, out_memory, _, future in pending:
+                    future.cancel()
+                    self.release(in_memory, out_memory)
+
+    def collect(self, item):
+        number, in_memory, out_memory, out_shape, future = item
+        try:
+            boxes = future.result()
+            preprocessed = np.ndarray(
+                out_shape, dtype=np.uint8, buffer=out_memory.buf
+            ).copy()
+        finally:
+            self.release(in_memory, out_memory)
+        return number, preprocessed, boxes
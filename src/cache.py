@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import time
+
+
+class DiskCache:
+    """Size-bounded LRU key/value store on top of SQLite.
+
+    Safe to share between processes: SQLite serializes the writers and WAL
+    mode lets readers run alongside them.
+    """
+
+    def __init__(self, path, max_bytes: int = 1024**3, ttl: float = None) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+
+    def connect(self):
+        conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self._ttl is not None and now - created > self._ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            return value
+        finally:
+            conn.close()
+
+    def set(self, key, value: bytes):
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now, now),
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _evict(self, conn):
+        if self._ttl is not None:
+            conn.execute(
+                "DELETE FROM entries WHERE created < ?", (time.time() - self._ttl,)
+            )
+        # keep the most recently used entries whose cumulated size fits
+        conn.execute(
+            """
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (
+                        ORDER BY accessed DESC, key ROWS UNBOUNDED PRECEDING
+                    ) AS running
+                    FROM entries
+                ) WHERE running > ?
+            )
+            """,
+            (self._max_bytes,),
+        )
@@ -0,0 +1,222 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from hashlib import blake2b
+
+import fitz
+
+from grobid.annotations import AnnotationStore
+from src.tracing import traced, tracer
+
+
+class DocumentStore:
+    """Processed documents on disk, shared by the sessions and the replicas.
+
+    Each document is a directory named after the hash of its content, holding
+    the PDF, the TEI, the annotation columns and the page sizes. Directories
+    are written aside and renamed in place, so a reader never sees a partial
+    document, and a lock file per hash makes the replicas sharing the
+    directory process a paper once. The annotation columns are memory mapped
+    when loaded: the processes share one copy through the page cache.
+
+    Above ``max_bytes``, the documents used least recently are removed after
+    each new one, as ``DiskCache`` evicts its entries.
+    """
+
+    def __init__(self, root, max_bytes: int = None) -> None:
+        self._root = root
+        self._max_bytes = max_bytes
+        os.makedirs(self._root, exist_ok=True)
+
+    def get_dir(self, doc_hash):
+        return os.path.join(self._root, doc_hash)
+
+    def get_meta_path(self, doc_hash):
+        return os.path.join(self.get_dir(doc_hash), "meta.json")
+
+    def get_pdf_path(self, doc_hash):
+        self.touch(doc_hash)
+        return os.path.join(self.get_dir(doc_hash), "document.pdf")
+
+    def touch(self, doc_hash):
+        # the time of meta.json is the last use, see evict
+        try:
+            os.utime(self.get_meta_path(doc_hash))
+        except FileNotFoundError:
+            pass
+
+    def spool(self, fileobj, chunk_size: int = 1024**2):
+        """Write ``fileobj`` to the spool directory, hashing it on the way.
+
+        Return ``(hash, path)``; the hash is ``get_file_hash``'s. The spooled
+        file is the only copy of the upload, ``put(..., move=True)`` moves it
+        into the document. Its name is unique to the upload, two sessions
+        uploading the same paper get a file each; the hash only names the
+        document.
+        """
+        spool_dir = os.path.join(self._root, ".spool")
+        os.makedirs(spool_dir, exist_ok=True)
+        digest = blake2b()
+        fd, path = tempfile.mkstemp(dir=spool_dir, prefix="upload-", suffix=".pdf")
+        try:
+            with tracer.span("upload.spool") as span, os.fdopen(fd, "wb") as fw:
+                for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+                    digest.update(chunk)
+                    fw.write(chunk)
+                span.set(bytes=fw.tell())
+        except BaseException:
+            os.unlink(path)
+            raise
+        return digest.hexdigest(), path
+
+    def __contains__(self, doc_hash):
+        return os.path.exists(self.get_meta_path(doc_hash))
+
+    @contextmanager
+    def lock(self, doc_hash):
+        path = os.path.join(self._root, f"{doc_hash}.lock")
+        with open(path, "a") as fw:
+            fcntl.flock(fw, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                # removed while held: a waiter on the old file and a newcomer
+                # on a new one may then both go on, they find the document
+                # stored or, after a failure, both try it
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                fcntl.flock(fw, fcntl.LOCK_UN)
+
+    @traced("store.put")
+    def put(self, doc_hash, input_path, result, move: bool = False):
+        """Store the PDF at ``input_path`` with GrobidProcessor's ``result``."""
+        tmp_dir = tempfile.mkdtemp(prefix=f".{doc_hash}.", dir=self._root)
+        try:
+            if move:
+                os.replace(input_path, os.path.join(tmp_dir, "document.pdf"))
+                input_path = os.path.join(tmp_dir, "document.pdf")
+            else:
+                shutil.copyfile(input_path, os.path.join(tmp_dir, "document.pdf"))
+            if result["tei"] is not None:
+                with open(os.path.join(tmp_dir, "tei.xml"), "w") as fw:
+                    fw.write(result["tei"])
+            AnnotationStore.from_dicts(result["coordinates"]).save(
+                os.path.join(tmp_dir, "annotations")
+            )
+            pages = result["pages"]
+            if not pages:
+                with fitz.open(input_path) as doc:
+                    pages = [
+                        {"width": page.rect.width, "height": page.rect.height}
+                        for page in doc
+                    ]
+            # written last, marks the document as complete
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as fw:
+                json.dump({"pages": pages}, fw)
+            os.rename(tmp_dir, self.get_dir(doc_hash))
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if doc_hash not in self:
+                raise
+        self.evict(keep=doc_hash)
+
+    @staticmethod
+    def get_size(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except FileNotFoundError:
+                    pass
+        return size
+
+    def evict(self, keep=None):
+        """Remove the documents used least recently, but ``keep``, until the
+        store fits in ``max_bytes``; return their hashes."""
+        if self._max_bytes is None:
+            return []
+        documents = []
+        for doc_hash in os.listdir(self._root):
+            if doc_hash.startswith("."):
+                # spooled uploads, documents being written or removed
+                continue
+            try:
+                used = os.stat(self.get_meta_path(doc_hash)).st_mtime
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            documents.append((used, doc_hash))
+        removed = []
+        total = 0
+        for _, doc_hash in sorted(documents, reverse=True):
+            total += self.get_size(self.get_dir(doc_hash))
+            if total <= self._max_bytes or doc_hash == keep:
+                continue
+            # out of sight at once, the sessions reading it keep their files
+            tmp_dir = tempfile.mkdtemp(prefix=f".{doc_hash}.", dir=self._root)
+            try:
+                os.rename(self.get_dir(doc_hash), tmp_dir)
+            except OSError:
+                # removed by another replica meanwhile
+                os.rmdir(tmp_dir)
+                continue
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            removed.append(doc_hash)
+        return removed
+
+    def get_or_process(
+        self, doc_hash, input_path, processor, move: bool = False, **kwargs
+    ):
+        """Process the document unless it is stored already; with ``move``,
+        ``input_path`` is moved into the store or removed. ``kwargs`` go to
+        ``processor.process_document``."""
+        try:
+            if doc_hash in self:
+                self.touch(doc_hash)
+                return True
+            with self.lock(doc_hash):
+                # another session or replica may have done it meanwhile
+                if doc_hash in self:
+                    return True
+                result = processor.process_document(
+                    input_path, file_hash=doc_hash, **kwargs
+                )
+                if result is None:
+                    return False
+                self.put(doc_hash, input_path, result, move)
+            return True
+        finally:
+            if move and os.path.exists(input_path):
+                os.unlink(input_path)
+
+    def get_meta(self, doc_hash):
+        with open(self.get_meta_path(doc_hash)) as fr:
+            return json.load(fr)
+
+    @traced("store.get_annotations")
+    def get_annotations(self, doc_hash):
+        self.touch(doc_hash)
+        return AnnotationStore.load(
+            os.path.join(self.get_dir(doc_hash), "annotations")
+        )
+
+    def get_segments(self, doc_hash, types):
+        """Segment list of ``AnnotationStore.get_segments``, kept on disk."""
+        digest = blake2b(json.dumps(sorted(types)).encode("utf-8"), digest_size=8)
+        path = os.path.join(
+            self.get_dir(doc_hash), f"segments-{digest.hexdigest()}.json"
+        )
+        if os.path.exists(path):
+            with open(path) as fr:
+                return [tuple(segment) for segment in json.load(fr)]
+        segments = self.get_annotations(doc_hash).get_segments(list(types))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fw:
+            json.dump(segments, fw)
+        os.replace(tmp_path, path)
+        return segments
@@ -0,0 +1,145 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+
+import cv2
+import fitz
+
+from grobid.grobid_processor import get_color
+from src.batch_preprocessing import BatchPreprocessor
+from src.pager import Pager
+from src.tracing import traced
+
+
+def get_page_hash(doc, page):
+    # content stream and images identify the page, whatever the document
+    digest = blake2b(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+
+def find_textless_pages(doc, min_chars: int = 1):
+    return [
+        page.number
+        for page in doc
+        if len(page.get_text("text").strip()) < min_chars
+    ]
+
+
+class OCRFallback:
+    """OCR of the pages without a text layer, which GROBID cannot read.
+
+    Textless pages are rendered, preprocessed and segmented in parallel, then
+    each region is read by Tesseract. The regions come out as annotations with
+    the same keys as GrobidProcessor's, in PDF coordinates. Results are cached
+    per page content, so a page is only read once.
+    """
+
+    def __init__(
+        self,
+        dpi: int = 300,
+        lang: str = "eng",
+        workers: int = None,
+        cache=None,
+        type: str = "p",
+        min_chars: int = 1,
+    ) -> None:
+        self._dpi = dpi
+        self._lang = lang
+        self._workers = workers or os.cpu_count()
+        self._cache = cache
+        self._type = type
+        self._min_chars = min_chars
+
+    @staticmethod
+    def is_available():
+        try:
+            import pytesseract
+
+            pytesseract.get_tesseract_version()
+        except Exception:
+            return False
+        return True
+
+    def cache_key(self, page_hash):
+        return f"ocr:{page_hash}:{self._dpi}:{self._lang}"
+
+    def read_region(self, region):
+        # imported here, Tesseract is only needed when a page has no text
+        import pytesseract
+
+        # preprocessing leaves white text on black, Tesseract wants the opposite
+        text = pytesseract.image_to_string(
+            cv2.bitwise_not(region), lang=self._lang, config="--psm 6"
+        )
+        return " ".join(text.split())
+
+    def to_annotation(self, box, text, color):
+        scale = 72 / self._dpi
+        x, y, w, h = (value * scale for value in box)
+        return {
+            "x": f"{x:.2f}",
+            "y": f"{y:.2f}",
+            "width": f"{w:.2f}",
+            "height": f"{h:.2f}",
+            "text": text,
+            "color": color,
+            "type": self._type,
+        }
+
+    def get_pages(self, input_path):
+        with fitz.open(input_path) as doc:
+            return [
+                {"width": page.rect.width, "height": page.rect.height} for page in doc
+            ]
+
+    @traced("ocr.process")
+    def process(self, input_path):
+        with fitz.open(input_path) as doc:
+            numbers = find_textless_pages(doc, self._min_chars)
+            hashes = {number: get_page_hash(doc, doc[number]) for number in numbers}
+
+        results = {}
+        missing = []
+        for number in numbers:
+            cached = None
+            if self._cache is not None:
+                cached = self._cache.get(self.cache_key(hashes[number]))
+            if cached is not None:
+                results[number] = json.loads(cached)
+            else:
+                missing.append(number)
+
+        if missing:
+            pager = Pager("", input_path, "png", dpi=self._dpi)
+            batch = BatchPreprocessor(workers=self._workers)
+            pages = pager.rasterize(
+                pages=missing, colorspace="gray", workers=self._workers
+            )
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                for number, preprocessed, boxes in batch.run(pages, channels="GRAY"):
+                    regions = [
+                        preprocessed[y : y + h, x : x + w] for x, y, w, h in boxes
+                    ]
+                    texts = executor.map(self.read_region, regions)
+                    annotations = []
+                    for box, text in zip(boxes, texts):
+                        if not text:
+                            continue
+                        color = get_color(self._type, len(annotations) % 2 == 0)
+                        annotations.append(self.to_annotation(box, text, color))
+                    results[number] = annotations
+                    if self._cache is not None:
+                        self._cache.set(
+                            self.cache_key(hashes[number]),
+                            json.dumps(annotations).encode("utf-8"),
+                        )
+
+        coordinates = []
+        for number in numbers:
+            for annotation in results[number]:
+                # GROBID's page numbers start at 1
+                coordinates.append({"page": str(number + 1), **annotation})
+        return coordinates
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+
+from src.tracing import tracer
+
+
+class PageWindow:
+    """Cut a PDF down to the pages on screen.
+
+    Slices are kept in a small LRU cache, and the windows before and after the
+    requested one are built in the background so that paging through the
+    document does not wait on PyMuPDF.
+    """
+
+    def __init__(self, binary, cache_size: int = 8) -> None:
+        if isinstance(binary, str):
+            # a path, PyMuPDF reads the pages from the file when needed
+            self._doc = fitz.open(binary)
+        else:
+            self._doc = fitz.open(stream=binary, filetype="pdf")
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        # PyMuPDF documents are not thread safe
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def page_count(self):
+        return self._doc.page_count
+
+    def get_window(self, start, size):
+        # 1-based pages as in GROBID's coordinates
+        start = max(1, min(start, self.page_count))
+        return list(range(start, min(start + size, self.page_count + 1)))
+
+    def get_slice(self, pages):
+        key = tuple(pages)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+            with tracer.span("viewer.slice", pages=len(pages)) as span:
+                out = fitz.open()
+                for first, last in self.get_runs(pages):
+                    out.insert_pdf(self._doc, from_page=first - 1, to_page=last - 1)
+                binary = out.tobytes()
+                out.close()
+                span.set(bytes=len(binary))
+
+            self._cache[key] = binary
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+            return binary
+
+    @staticmethod
+    def get_runs(pages):
+        runs = []
+        for page in pages:
+            if runs and runs[-1][1] == page - 1:
+                runs[-1][1] = page
+            else:
+                runs.append([page, page])
+        return runs
+
+    def prefetch(self, start, size):
+        for neighbour in (start + size, start - size):
+            if 1 - size < neighbour <= self.page_count:
+                window = self.get_window(neighbour, size)
+                self._executor.submit(self.get_slice, window)
+
+    @staticmethod
+    def remap(annotations, pages):
+        # page numbers of the annotations within the slice
+        positions = {page: i + 1 for i, page in enumerate(pages)}
+        for annotation in annotations:
+            annotation["page"] = positions[annotation["page"]]
+        return annotations
@@ -1,21 +1,43 @@
 import fitz
 import os
 
+from src.raster import RasterEngine
+
 
 class Pager:
-    def __init__(self, base_dir, in_filename, image_format) -> None:
+    def __init__(self, base_dir, in_filename, image_format, dpi: int = None) -> None:
         self._base_dir = os.environ.get("BASE_DIR", base_dir)
         self._in_filename = in_filename
         self._image_format = image_format
+        self._dpi = dpi
         self._file_path = os.path.join(self._base_dir, self._in_filename)
         self.open_file()
 
     def open_file(self):
         self._doc = fitz.open(self._file_path)
 
-    def paginator(self):
-        for i, page in enumerate(self._doc.pages()):
-            out_filename = self._in_filename.split(".")[:-1]
-            pix = page.get_pixmap()
-            image_path = os.path.join(self._base_dir, out_filename)
-            pix.save(image_path, output=self._image_format)
+    def get_stem(self):
+        return os.path.splitext(os.path.basename(self._in_filename))[0]
+
+    def pixmaps(self, pages=None, colorspace=fitz.csRGB):
+        # rendered in this process, to be wrapped by ImageProcessor.from_pixmap
+        if pages is None:
+            pages = range(self._doc.page_count)
+        for number in pages:
+            yield number, self._doc[number].get_pixmap(
+                dpi=self._dpi, colorspace=colorspace, alpha=False
+            )
+
+    def get_engine(self, **kwargs):
+        params = {"dpi": self._dpi, "image_format": self._image_format, **kwargs}
+        return RasterEngine(self._file_path, **params)
+
+    def paginator(self, pages=None, workers: int = None):
+        # one image per page, rendered in parallel: <stem>_<page>.<format>
+        engine = self.get_engine(workers=workers)
+        return engine.save(self._base_dir, self.get_stem(), pages)
+
+    def rasterize(self, pages=None, **kwargs):
+        # in memory pages, NumPy arrays unless an image_format is given
+        params = {"image_format": None, **kwargs}
+        return self.get_engine(**params).render(pages)
@@ -0,0 +1,160 @@
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+GRAY_CONVERSIONS = {
+    "BGR": cv2.COLOR_BGR2GRAY,
+    "BGRA": cv2.COLOR_BGRA2GRAY,
+    "RGB": cv2.COLOR_RGB2GRAY,
+    "RGBA": cv2.COLOR_RGBA2GRAY,
+}
+
+
+@lru_cache(maxsize=None)
+def get_kernel(shape):
+    # rectangular structuring element of shape (rows, columns)
+    return np.ones(shape, np.uint8)
+
+
+def op_gray(src, dst, channels="BGR"):
+    if src.ndim == 2 or src.shape[2] == 1:
+        np.copyto(dst, src.reshape(dst.shape))
+    else:
+        cv2.cvtColor(src, GRAY_CONVERSIONS[channels], dst=dst)
+
+
+def op_threshold(src, dst, params=(100, 252)):
+    cv2.threshold(
+        src, params[0], params[1], cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=dst
+    )
+
+
+def op_blur(src, dst, ksize=(5, 5)):
+    cv2.GaussianBlur(src, ksize, 0, dst=dst)
+
+
+def op_dilate(src, dst, kernel=(1, 1), iterations=1):
+    cv2.dilate(src, get_kernel(tuple(kernel)), dst=dst, iterations=iterations)
+
+
+def op_erode(src, dst, kernel=(1, 1), iterations=1):
+    cv2.erode(src, get_kernel(tuple(kernel)), dst=dst, iterations=iterations)
+
+
+def op_median(src, dst, ksize=3):
+    cv2.medianBlur(src, ksize, dst=dst)
+
+
+def op_invert(src, dst):
+    cv2.bitwise_not(src, dst=dst)
+
+
+OPERATIONS = {
+    "gray": op_gray,
+    "threshold": op_threshold,
+    "blur": op_blur,
+    "dilate": op_dilate,
+    "erode": op_erode,
+    "median": op_median,
+    "invert": op_invert,
+}
+
+
+class PreprocessPipeline:
+    """Ordered grayscale operations run on two preallocated buffers.
+
+    Every operation writes its output in the buffer its input is not in, so a
+    page goes through the whole pipeline without allocating. Each thread has
+    its own buffers, and the returned image is one of them: it is overwritten
+    by the next ``run`` of the same thread.
+    """
+
+    def __init__(self, ops) -> None:
+        # [(name, {param: value}), ...]
+        self.ops = [(name, dict(params)) for name, params in ops]
+        for name, _ in self.ops:
+            if name not in OPERATIONS:
+                raise ValueError(f"Unknown operation: {name}")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.timings = {name: 0.0 for name, _ in self.ops}
+        self.runs = 0
+
+    @classmethod
+    def from_params(
+        cls,
+        params: tuple = (252, 252),
+        kernel_dilate: tuple = (1, 1),
+        kernel_erode: tuple = (1, 1),
+        iteration_dilate: int = 1,
+        iteration_erode: int = 1,
+        ksize: int = 3,
+    ):
+        # the steps of ImageProcessor.preprocess
+        return cls(
+            [
+                ("gray", {}),
+                ("threshold", {"params": params}),
+                ("dilate", {"kernel": kernel_dilate, "iterations": iteration_dilate}),
+                ("erode", {"kernel": kernel_erode, "iterations": iteration_erode}),
+                ("median", {"ksize": ksize}),
+            ]
+        )
+
+    def get_buffers(self, shape):
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = self._local.buffers = (
+                np.empty(shape, dtype=np.uint8),
+                np.empty(shape, dtype=np.uint8),
+            )
+        return buffers
+
+    def run(self, image, channels: str = "BGR", out=None):
+        buffers = self.get_buffers(image.shape[:2])
+        src, free = image, 0
+        timings = []
+        for name, params in self.ops:
+            start = time.perf_counter()
+            if name == "gray":
+                op_gray(src, buffers[free], channels)
+            else:
+                if src.ndim == 3:
+                    # the other operations work on a single channel
+                    op_gray(src, buffers[free], channels)
+                    src, free = buffers[free], 1 - free
+                OPERATIONS[name](src, buffers[free], **params)
+            src, free = buffers[free], 1 - free
+            timings.append((name, time.perf_counter() - start))
+        with self._lock:
+            for name, elapsed in timings:
+                self.timings[name] += elapsed
+            self.runs += 1
+        if out is not None:
+            np.copyto(out, src.reshape(out.shape))
+            return out
+        if src is image:
+            # no operation at all
+            return src.copy()
+        return src
+
+    def run_batch(self, images, channels: str = "BGR", out=None):
+        """Yield the result of each image, in ``out[i]`` when given, e.g. an
+        array of shape (count, height, width). Otherwise each result is a
+        buffer, overwritten by the next image: copy the ones to keep."""
+        for i, image in enumerate(images):
+            yield self.run(image, channels, None if out is None else out[i])
+
+    def report(self):
+        total = sum(self.timings.values())
+        lines = [f"{self.runs} images, {total * 1000:.1f} ms"]
+        for name, elapsed in self.timings.items():
+            share = elapsed / total * 100 if total else 0
+            per_image = elapsed / max(self.runs, 1) * 1000
+            lines.append(
+                f"{name:>10}: {per_image:8.2f} ms/image {share:5.1f}%"
+            )
+        return "\n".join(lines)
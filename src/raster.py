@@ -0,0 +1,126 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+import numpy as np
+
+from src.workers import get_mp_context
+
+COLORSPACES = {"rgb": fitz.csRGB, "gray": fitz.csGRAY, "cmyk": fitz.csCMYK}
+
+# document opened by each worker process
+_doc = None
+
+
+def open_document(file_path):
+    global _doc
+    _doc = fitz.open(file_path)
+
+
+def pixmap_to_array(pix):
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+        pix.height, pix.width, pix.n
+    )
+
+
+def render_pages(pages, dpi, colorspace, image_format):
+    results = []
+    for number in pages:
+        pix = _doc[number].get_pixmap(
+            dpi=dpi, colorspace=COLORSPACES[colorspace], alpha=False
+        )
+        if image_format is None:
+            results.append(pixmap_to_array(pix))
+        else:
+            results.append(pix.tobytes(output=image_format))
+    return results
+
+
+class RasterEngine:
+    """Render the pages of a PDF on a pool of processes.
+
+    Each worker opens the document once and renders chunks of consecutive
+    pages. ``render`` yields the pages in order as soon as they are ready, as
+    NumPy arrays (height, width, channels) or, with ``image_format``, as
+    encoded images.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        dpi: int = 150,
+        colorspace: str = "rgb",
+        image_format: str = None,
+        workers: int = None,
+        chunk_size: int = 4,
+    ) -> None:
+        self._file_path = file_path
+        self._dpi = dpi
+        self._colorspace = colorspace
+        self._image_format = image_format
+        self._workers = workers or os.cpu_count()
+        self._chunk_size = chunk_size
+        with fitz.open(self._file_path) as doc:
+            self._page_count = doc.page_count
+
+    @property
+    def page_count(self):
+        return self._page_count
+
+    def get_chunks(self, pages):
+        return [
+            pages[i : i + self._chunk_size]
+            for i in range(0, len(pages), self._chunk_size)
+        ]
+
+    def render(self, pages=None):
+        """Yield ``(page number, image)`` with 0-based page numbers."""
+        return self.render_as(pages, self._image_format)
+
+    def render_as(self, pages, image_format):
+        if pages is None:
+            pages = range(self._page_count)
+        chunks = self.get_chunks(list(pages))
+        with ProcessPoolExecutor(
+            max_workers=min(self._workers, max(len(chunks), 1)),
+            mp_context=get_mp_context(),
+            initializer=open_document,
+            initargs=(self._file_path,),
+        ) as executor:
+            # a couple of chunks ahead per worker keeps memory bounded
+            pending = deque()
+            for chunk in chunks:
+                pending.append(
+                    (
+                        chunk,
+                        executor.submit(
+                            render_pages,
+                            chunk,
+                            self._dpi,
+                            self._colorspace,
+                            image_format,
+                        ),
+                    )
+                )
+                if len(pending) >= 2 * self._workers:
+                    yield from self.pop_ready(pending)
+            while pending:
+                yield from self.pop_ready(pending)
+
+    @staticmethod
+    def pop_ready(pending):
+        chunk, future = pending.popleft()
+        yield from zip(chunk, future.result())
+
+    def save(self, out_dir, stem, pages=None):
+        """Write the pages to ``out_dir/{stem}_{page}.{image_format}``."""
+        image_format = self._image_format or "png"
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for number, data in self.render_as(pages, image_format):
+            path = os.path.join(out_dir, f"{stem}_{number}.{image_format}")
+            with open(path, "wb") as fw:
+                fw.write(data)
+            paths.append(path)
+        return paths
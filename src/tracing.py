@@ -0,0 +1,244 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the trace the spans of the running code belong to
+_current = ContextVar("trace", default=None)
+
+# upper bounds of the Prometheus histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def get_rss():
+    # resident memory in bytes, cheap enough to read around every span
+    try:
+        with open("/proc/self/statm") as fr:
+            return int(fr.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, attrs) -> None:
+        self._tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+        self.depth = 0
+
+    def set(self, **attrs):
+        """Attach e.g. ``bytes=`` or any value known inside the span."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.depth = self.trace.depth
+            self.trace.depth += 1
+        self._rss = get_rss()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        rss = get_rss()
+        record = {
+            "name": self.name,
+            # from the start of the trace
+            "offset": self._start - self.trace.start if self.trace else 0.0,
+            "duration": duration,
+            "depth": self.depth,
+            "memory": rss - self._rss if rss is not None and self._rss else None,
+            **self.attrs,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.trace is not None:
+            self.trace.depth -= 1
+            self.trace.spans.append(record)
+        self._tracer.record(record, standalone=self.trace is None)
+        return False
+
+
+class Trace:
+    """The spans of one request, e.g. a rerun of the application."""
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+
+    def breakdown(self):
+        # in the order the spans started
+        return sorted(self.spans, key=lambda span: span["offset"])
+
+
+class JsonlExporter:
+    def __init__(self, path) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, name, spans):
+        line = json.dumps({"trace": name, "time": time.time(), "spans": spans})
+        with self._lock, open(self._path, "a") as fw:
+            fw.write(line + "\n")
+
+
+class PrometheusExporter:
+    """Histogram of the span durations, served in Prometheus' text format."""
+
+    def __init__(self, port: int = None) -> None:
+        self._lock = threading.Lock()
+        # name: [bucket counts, count, sum, bytes]
+        self._metrics = {}
+        if port:
+            self.serve(port)
+
+    def export(self, name, spans):
+        with self._lock:
+            for span in spans:
+                metric = self._metrics.setdefault(
+                    span["name"], [[0] * len(BUCKETS), 0, 0.0, 0]
+                )
+                for i, bound in enumerate(BUCKETS):
+                    if span["duration"] <= bound:
+                        metric[0][i] += 1
+                metric[1] += 1
+                metric[2] += span["duration"]
+                metric[3] += span.get("bytes") or 0
+
+    def render(self):
+        # the samples of a family come together, under its TYPE line
+        seconds_lines = ["# TYPE paperx_span_seconds histogram"]
+        bytes_lines = ["# TYPE paperx_span_bytes_total counter"]
+        with self._lock:
+            for name, (buckets, count, total, size) in sorted(self._metrics.items()):
+                labels = f'span="{name}"'
+                for bound, bucket in zip(BUCKETS, buckets):
+                    seconds_lines.append(
+                        f'paperx_span_seconds_bucket{{{labels},le="{bound}"}} {bucket}'
+                    )
+                seconds_lines.append(
+                    f'paperx_span_seconds_bucket{{{labels},le="+Inf"}} {count}'
+                )
+                seconds_lines.append(f"paperx_span_seconds_count{{{labels}}} {count}")
+                seconds_lines.append(f"paperx_span_seconds_sum{{{labels}}} {total}")
+                bytes_lines.append(f"paperx_span_bytes_total{{{labels}}} {size}")
+        return "\n".join(seconds_lines + bytes_lines) + "\n"
+
+    def serve(self, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        except OSError as e:
+            # another process of the application serves it
+            print(f"Exception occurred: {e}")
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+class Tracer:
+    """Spans with their duration, memory delta and byte counts.
+
+    Spans opened between ``start_trace`` and ``finish`` are collected in that
+    trace and exported together; the others, e.g. in a background thread,
+    are exported on their own. Disabled, ``span`` returns a shared no-op.
+    """
+
+    def __init__(self, enabled: bool = False, exporters=()) -> None:
+        self.enabled = enabled
+        self.exporters = list(exporters)
+
+    @classmethod
+    def from_env(cls):
+        exporters = []
+        if os.environ.get("TRACING_JSONL"):
+            exporters.append(JsonlExporter(os.environ["TRACING_JSONL"]))
+        if os.environ.get("TRACING_PROMETHEUS_PORT"):
+            exporters.append(
+                PrometheusExporter(int(os.environ["TRACING_PROMETHEUS_PORT"]))
+            )
+        return cls(os.environ.get("TRACING", "0") == "1", exporters)
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def start_trace(self, name):
+        if not self.enabled:
+            return None
+        trace = Trace(name)
+        _current.set(trace)
+        return trace
+
+    def finish(self, trace):
+        if trace is None:
+            return
+        _current.set(None)
+        self.export(trace.name, trace.breakdown())
+
+    def record(self, record, standalone):
+        if standalone:
+            self.export(record["name"], [record])
+
+    def export(self, name, spans):
+        for exporter in self.exporters:
+            try:
+                exporter.export(name, spans)
+            except Exception as e:
+                print(f"Exception occurred: {e}")
+
+
+tracer = Tracer.from_env()
+
+
+def traced(name):
+    """Run the decorated function in a span of the module's tracer."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,18 @@
+import multiprocessing
+
+# imported once by the fork server instead of by every worker
+PRELOAD = ["numpy", "cv2", "fitz", "src.raster", "src.batch_preprocessing"]
+
+
+def get_mp_context():
+    """Start method of the process pools: a fork server.
+
+    Forking the caller, e.g. a thread of the Streamlit server, copies the
+    locks its other threads hold, and a worker can wait on them forever. The
+    workers fork from a single threaded server instead, which has the
+    libraries of ``PRELOAD`` imported already.
+    """
+    context = multiprocessing.get_context("forkserver")
+    # no effect once the server runs
+    context.set_forkserver_preload(PRELOAD)
+    return context
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.fixtures import SAMPLE_PDF, synthetic_tei
+from grobid.async_grobid_processor import AsyncGrobidProcessor
+from grobid.grobid_processor import GrobidProcessor
+
+TEI = synthetic_tei()
+
+
+class StubGrobid(ThreadingHTTPServer):
+    """GROBID answering the sample TEI, busy for the first ``busy`` requests."""
+
+    daemon_threads = True
+
+    def __init__(self, busy=0, delay=0.05):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.busy = busy
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.forms = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.answer(200 if self.path == "/api/isalive" else 404, "true")
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.forms.append(body)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            busy = server.busy > 0
+            server.busy -= busy
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        self.answer(503 if busy else 200, "" if busy else TEI)
+
+    def answer(self, status, text):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(request):
+    server = StubGrobid(**getattr(request, "param", {}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_processor(stub, **kwargs):
+    config = {"grobid_server": stub.url, "sleep_time": 0.01, "coordinates": ["s"]}
+    return AsyncGrobidProcessor(config, **kwargs)
+
+
+def test_process_structure(stub):
+    async def run():
+        async with get_processor(stub) as processor:
+            return await processor.aprocess_structure(SAMPLE_PDF)
+
+    coordinates, pages = GrobidProcessor(None).parse_tei(TEI)
+    assert asyncio.run(run()) == (coordinates, len(pages))
+    assert b'name="segmentSentences"' in stub.forms[0]
+
+
+@pytest.mark.parametrize("stub", [{"delay": 0.1}], indirect=True)
+def test_concurrency_cap(stub):
+    async def run():
+        async with get_processor(stub, n=2) as processor:
+            return await asyncio.gather(
+                *(processor.arequest_tei(SAMPLE_PDF) for _ in range(6))
+            )
+
+    results = asyncio.run(run())
+    assert [status for status, _ in results] == [200] * 6
+    assert stub.max_in_flight == 2
+
+
+@pytest.mark.parametrize("stub", [{"busy": 2}], indirect=True)
+def test_retry_busy(stub):
+    async def run():
+        async with get_processor(stub) as processor:
+            return await processor.arequest_tei(SAMPLE_PDF)
+
+    status, text = asyncio.run(run())
+    assert status == 200 and text == TEI
+    assert len(stub.forms) == 3
+
+
+def test_synchronous_callers(stub):
+    # the methods inherited from GrobidProcessor get a (status, text) back
+    processor = get_processor(stub)
+    result = processor.process_document(SAMPLE_PDF)
+    assert result["tei"] == TEI
+    assert processor.process_header(SAMPLE_PDF)["tei"] == TEI
+    # the full text of the first page, with its coordinates
+    assert b'name="end"\r\n\r\n1' in stub.forms[-1]
+    assert b'name="teiCoordinates"' in stub.forms[-1]
+    result = processor.process_document(SAMPLE_PDF, chunk_pages=8)
+    assert result["tei"] is None and result["coordinates"]
+    assert b'name="start"\r\n\r\n9' in stub.forms[-1]
+
+
+def test_default_coordinates(stub):
+    # without coordinates in the config, config.json's are asked for
+    processor = AsyncGrobidProcessor({"grobid_server": stub.url})
+    processor.request_tei(SAMPLE_PDF)
+    assert b'name="teiCoordinates"\r\n\r\npersName' in stub.forms[0]
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm.backends import OpenAIBackend, TimedStream
+
+TOKENS = ["The", " paper", " is", " about", " attention", "."]
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    """OpenAI-compatible server streaming ``TOKENS``, ``delay`` seconds apart
+    and ``first_delay`` before the first one."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.01, first_delay=0.2):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.delay = delay
+        self.first_delay = first_delay
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.requests.append((self.path, json.loads(body)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(server.first_delay)
+        for i, token in enumerate(TOKENS):
+            if i:
+                time.sleep(server.delay)
+            chunk = {
+                "id": "cmpl-stub",
+                "object": "text_completion",
+                "created": 0,
+                "model": "stub",
+                "choices": [
+                    {"index": 0, "text": token, "logprobs": None, "finish_reason": None}
+                ],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubOpenAI()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+PARAMS = {"temperature": 0.1, "top_p": 0.9, "max_length": 64, "repetition_penalty": 1}
+
+
+def test_generate(stub):
+    backend = OpenAIBackend(stub.url, "stub-model")
+    assert list(backend.generate("Hello", PARAMS)) == TOKENS
+    path, body = stub.requests[0]
+    assert path == "/v1/completions"
+    assert body["model"] == "stub-model" and body["prompt"] == "Hello"
+    assert body["stream"] is True
+    assert (body["max_tokens"], body["temperature"], body["top_p"]) == (64, 0.1, 0.9)
+    assert backend.model_id == f"openai:{stub.url}:stub-model"
+
+
+def test_timed_stream(stub):
+    backend = OpenAIBackend(stub.url, "stub-model")
+    stream = TimedStream(backend.generate("Hello", PARAMS))
+    assert stream.report() == "no output"
+    assert "".join(stream) == "".join(TOKENS)
+    # the first token waits for the server, the others come right behind
+    assert stub.first_delay <= stream.ttft < stream.elapsed
+    assert stream.count == len(TOKENS)
+    assert stream.report().startswith("first token in ")
+    assert f"{len(TOKENS)} chunks in" in stream.report()
+
+
+def test_stop_early(stub):
+    backend = OpenAIBackend(stub.url, "stub-model")
+    tokens = backend.generate("Hello", PARAMS)
+    assert next(tokens) == TOKENS[0]
+    # closing the generator closes the response, the client goes on
+    tokens.close()
+    assert list(backend.generate("Again", PARAMS)) == TOKENS
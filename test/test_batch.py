@@ -0,0 +1,121 @@
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.fixtures import SAMPLE_PDF, synthetic_tei
+from grobid.batch import BatchProcessor
+from grobid.grobid_processor import GrobidProcessor, get_file_hash
+from grobid.pool import GrobidPool
+
+TEI = synthetic_tei()
+
+
+class StubGrobid(ThreadingHTTPServer):
+    """GROBID answering the sample TEI, busy for the first ``busy`` requests."""
+
+    daemon_threads = True
+
+    def __init__(self, busy=0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.busy = busy
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.answer(200, "true")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests += 1
+        busy = self.server.requests <= self.server.busy
+        self.answer(503 if busy else 200, "" if busy else TEI)
+
+    def answer(self, status, text):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(request):
+    server = StubGrobid(**getattr(request, "param", {}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_batch(stub, output_dir, max_retries=3):
+    # a busy server only, the breaker stays closed
+    pool = GrobidPool(
+        [stub.url], {"coordinates": ["s"]}, failure_threshold=10, check_interval=3600
+    )
+    return BatchProcessor(
+        GrobidProcessor(pool),
+        str(output_dir),
+        n=2,
+        sleep_time=0.01,
+        max_retries=max_retries,
+    )
+
+
+def read_journal(output_dir):
+    with open(os.path.join(output_dir, "journal.jsonl")) as fr:
+        return [json.loads(line) for line in fr]
+
+
+@pytest.mark.parametrize("stub", [{"busy": 2}], indirect=True)
+def test_retry_busy(stub, tmp_path):
+    start = time.perf_counter()
+    counts = get_batch(stub, tmp_path / "output").run([SAMPLE_PDF])
+    assert counts == {"done": 1, "skipped": 0, "failed": 0}
+    assert stub.requests == 3
+    # backed off 0.01 then 0.02 seconds
+    assert time.perf_counter() - start >= 0.03
+    with open(tmp_path / "output" / f"{get_file_hash(SAMPLE_PDF)}.json") as fr:
+        assert json.load(fr)["annotations"]
+
+
+@pytest.mark.parametrize("stub", [{"busy": 10}], indirect=True)
+def test_give_up(stub, tmp_path):
+    counts = get_batch(stub, tmp_path / "output", max_retries=2).run([SAMPLE_PDF])
+    assert counts["failed"] == 1
+    assert stub.requests == 3
+    (entry,) = read_journal(tmp_path / "output")
+    assert entry["status"] == "failed" and entry["code"] == 503
+
+
+def test_failures_and_resume(stub, tmp_path):
+    copy = tmp_path / "copy.pdf"
+    shutil.copyfile(SAMPLE_PDF, copy)
+    inputs = [str(tmp_path / "missing.pdf"), SAMPLE_PDF, str(copy)]
+    batch = get_batch(stub, tmp_path / "output")
+    counts = batch.run(inputs)
+    # the copy is the same document, done once whichever comes first
+    assert counts["failed"] == 1 and counts["done"] >= 1
+    assert counts["done"] + counts["skipped"] == 2
+    (failed,) = [
+        entry
+        for entry in read_journal(tmp_path / "output")
+        if entry["status"] == "failed"
+    ]
+    assert failed["error"].startswith("FileNotFoundError")
+
+    # an interrupted run picks up where it stopped
+    counts = get_batch(stub, tmp_path / "output").run(inputs)
+    assert counts == {"done": 0, "skipped": 2, "failed": 1}
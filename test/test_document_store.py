@@ -0,0 +1,84 @@
+import io
+import os
+import time
+
+from benchmarks.fixtures import SAMPLE_PDF
+from grobid.grobid_processor import get_file_hash
+from src.document_store import DocumentStore
+
+ANNOTATION = {
+    "page": "1",
+    "x": "10.0",
+    "y": "20.0",
+    "width": "30.0",
+    "height": "40.0",
+    "text": "Attention",
+    "color": "rgba(255, 0, 0, 1)",
+    "type": "title",
+}
+
+
+class StubProcessor:
+    def __init__(self):
+        self.calls = 0
+
+    def process_document(self, input_path, file_hash=None, **kwargs):
+        self.calls += 1
+        return {"tei": "<TEI/>", "coordinates": [ANNOTATION], "pages": []}
+
+
+def add(store, processor, content):
+    doc_hash, spool_path = store.spool(io.BytesIO(content))
+    assert store.get_or_process(doc_hash, spool_path, processor, move=True)
+    assert not os.path.exists(spool_path)
+    return doc_hash
+
+
+def test_spool_and_process(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    processor = StubProcessor()
+    with open(SAMPLE_PDF, "rb") as fr:
+        content = fr.read()
+    doc_hash = add(store, processor, content)
+    assert doc_hash == get_file_hash(SAMPLE_PDF)
+    assert doc_hash in store
+    (annotation,) = store.get_annotations(doc_hash).to_dicts()
+    assert annotation["text"] == "Attention" and annotation["page"] == 1
+    # the page sizes of the PDF when GROBID gave none
+    assert len(store.get_meta(doc_hash)["pages"]) == 15
+
+    # once per document, and no lock file left behind
+    add(store, processor, content)
+    assert processor.calls == 1
+    assert sorted(os.listdir(tmp_path)) == [".spool", doc_hash]
+
+
+def test_evict_least_recently_used(tmp_path):
+    with open(SAMPLE_PDF, "rb") as fr:
+        content = fr.read()
+    # room for two documents
+    store = DocumentStore(str(tmp_path), max_bytes=int(2.5 * len(content)))
+    processor = StubProcessor()
+    first = add(store, processor, content)
+    time.sleep(0.01)
+    second = add(store, processor, content + b"\n%second")
+    time.sleep(0.01)
+    # used again, the second one is now the oldest
+    store.get_pdf_path(first)
+    time.sleep(0.01)
+    third = add(store, processor, content + b"\n%third")
+    assert first in store and third in store
+    assert second not in store
+    assert not [name for name in os.listdir(tmp_path) if second in name]
+
+
+def test_keep_the_new_document(tmp_path):
+    # a document bigger than the store stays until the next one comes
+    store = DocumentStore(str(tmp_path), max_bytes=1)
+    processor = StubProcessor()
+    with open(SAMPLE_PDF, "rb") as fr:
+        content = fr.read()
+    first = add(store, processor, content)
+    assert first in store
+    second = add(store, processor, content + b"\n%second")
+    assert second in store and first not in store
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import SAMPLE_PDF
+from src.pager import Pager
+from src.preprocessing import ImageProcessor, get_pipeline
+
+PARAMS = [
+    {},
+    {"params": (100, 252), "kernel_dilate": (2, 2), "kernel_erode": (3, 1)},
+    {"iteration_dilate": 2, "iteration_erode": 3, "ksize": 5},
+]
+
+
+@pytest.fixture(scope="module")
+def pages():
+    pager = Pager("", SAMPLE_PDF, "png", dpi=72)
+    return [ImageProcessor.from_pixmap(pix) for _, pix in pager.pixmaps()]
+
+
+def step_by_step(processor, params):
+    # the chain of ImageProcessor calls the pipeline replaces
+    params = {
+        "params": (252, 252),
+        "kernel_dilate": (1, 1),
+        "kernel_erode": (1, 1),
+        "iteration_dilate": 1,
+        "iteration_erode": 1,
+        "ksize": 3,
+        **params,
+    }
+    gray = processor.get_gray_scale()
+    thresh = processor.get_threshold(params.pop("params"), in_image=gray)
+    return processor.get_remove_noise(**params, in_image=thresh)
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_preprocess(pages, params):
+    for processor in pages:
+        processor.reset_image()
+        expected = step_by_step(processor, params)
+        result = processor.preprocess(**params)
+        processor.reset_image()
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_threads(pages):
+    # one pipeline, shared by the threads, each with its own buffers
+    pipeline = get_pipeline((252, 252), (1, 1), (1, 1), 1, 1, 3)
+    expected = [step_by_step(processor, {}) for processor in pages]
+
+    def run(processor):
+        return pipeline.run(processor._base_image, processor._channels).copy()
+
+    for _ in range(3):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(run, pages * 4))
+        for result, image in zip(results, expected * 4):
+            np.testing.assert_array_equal(result, image)
+
+
+def test_no_allocation(pages):
+    # one buffer of the thread for every page of the same size
+    results = []
+    for processor in pages[:3]:
+        processor.reset_image()
+        results.append(processor.preprocess())
+    assert all(result is results[0] for result in results)
+
+    out = np.empty_like(results[0])
+    processor = pages[0]
+    processor.reset_image()
+    expected = step_by_step(processor, {})
+    assert processor.preprocess(out=out) is out
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_run_batch(pages):
+    pipeline = get_pipeline((252, 252), (1, 1), (1, 1), 1, 1, 3)
+    for processor in pages:
+        processor.reset_image()
+    images = [processor._base_image for processor in pages[:4]]
+    out = np.empty((len(images),) + images[0].shape[:2], dtype=np.uint8)
+    results = list(pipeline.run_batch(images, pages[0]._channels, out=out))
+    for i, (result, processor) in enumerate(zip(results, pages)):
+        assert np.shares_memory(result, out[i])
+        np.testing.assert_array_equal(out[i], step_by_step(processor, {}))
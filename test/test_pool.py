@@ -0,0 +1,167 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.fixtures import SAMPLE_PDF
+from grobid.grobid_processor import GROBID_OPTIONS, GROBID_SERVICE
+from grobid.pool import GrobidPool
+
+
+class StubGrobid(ThreadingHTTPServer):
+    """GROBID answering ``status`` to every document, alive while ``alive``."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.delay = delay
+        self.status = 200
+        self.alive = True
+        self.forms = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        alive = self.path == "/api/isalive" and self.server.alive
+        self.answer(200 if alive else 500, "true")
+
+    def do_POST(self):
+        server = self.server
+        server.forms.append(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(server.delay)
+        self.answer(server.status, "<TEI/>" if server.status == 200 else "")
+
+    def answer(self, status, text):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stubs():
+    servers = []
+
+    def start(count=1, **kwargs):
+        for _ in range(count):
+            server = StubGrobid(**kwargs)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            servers.append(server)
+        return servers
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def get_pool(servers, **kwargs):
+    # the health checks are the tests' to run
+    return GrobidPool(
+        [server.url for server in servers],
+        {"coordinates": ["s"], "timeout": 5},
+        check_interval=3600,
+        **kwargs,
+    )
+
+
+def process(pool):
+    return pool.process_pdf(GROBID_SERVICE, SAMPLE_PDF, **GROBID_OPTIONS)[1]
+
+
+def test_least_outstanding(stubs):
+    servers = stubs(2, delay=0.2)
+    pool = get_pool(servers)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        statuses = list(executor.map(lambda _: process(pool), range(4)))
+    pool.close()
+    assert statuses == [200] * 4
+    # each server had two requests in flight at most
+    assert [len(server.forms) for server in servers] == [2, 2]
+    assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
+
+
+def test_busy_is_returned(stubs):
+    # no retry behind the caller's back, the 503 is the caller's to handle
+    (server,) = stubs()
+    server.status = 503
+    pool = get_pool([server])
+    assert process(pool) == 503
+    pool.close()
+    assert len(server.forms) == 1
+    assert b'name="teiCoordinates"\r\n\r\ns' in server.forms[0]
+
+
+def test_page_range(stubs):
+    (server,) = stubs()
+    pool = get_pool([server])
+    pool.process_pdf(GROBID_SERVICE, SAMPLE_PDF, start=2, end=3)
+    pool.close()
+    assert b'name="start"\r\n\r\n2' in server.forms[0]
+    assert b'name="end"\r\n\r\n3' in server.forms[0]
+
+
+def test_breaker(stubs):
+    (server,) = stubs()
+    server.status = 503
+    pool = get_pool([server], failure_threshold=2, open_seconds=0.3)
+    assert [process(pool) for _ in range(2)] == [503, 503]
+    assert pool.stats()[0]["open"]
+    # answered by the pool, the server is left alone
+    assert process(pool) == 503
+    assert len(server.forms) == 2
+
+    # half open after open_seconds: one request tries the server again
+    server.status = 200
+    time.sleep(0.35)
+    assert process(pool) == 200
+    assert len(server.forms) == 3
+    assert not pool.stats()[0]["open"]
+    pool.close()
+
+
+def test_breaker_routes_around(stubs):
+    failing, healthy = stubs(2)
+    failing.status = 500
+    pool = get_pool([failing, healthy], failure_threshold=1, open_seconds=60)
+    assert [process(pool) for _ in range(4)] == [500, 200, 200, 200]
+    pool.close()
+    assert (len(failing.forms), len(healthy.forms)) == (1, 3)
+
+
+def test_check_health(stubs):
+    (server,) = stubs()
+    # nothing listens on the port of a closed server
+    closed = StubGrobid()
+    closed.server_close()
+    pool = GrobidPool(
+        [server.url, closed.url], {"coordinates": ["s"]}, check_interval=3600
+    )
+    assert [endpoint.healthy for endpoint in pool.endpoints] == [True, False]
+    assert pool.available() == pool.endpoints[:1]
+
+    server.alive = False
+    pool.check_health()
+    assert pool.available() == []
+    assert process(pool) == 503
+    assert server.forms == []
+
+    # back up, with a clean slate
+    server.alive = True
+    pool.endpoints[0].failures = 5
+    pool.check_health()
+    assert pool.available() == pool.endpoints[:1]
+    assert pool.endpoints[0].failures == 0
+    assert process(pool) == 200
+    pool.close()
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from benchmarks.fixtures import SAMPLE_TEI, load_tei, synthetic_tei
+from grobid.grobid_processor import GrobidProcessor
+
+WHITESPACES = ("", " ", "\n", "\t", "\n\t\t", "  \n ", "\r\n")
+
+
+@pytest.fixture(scope="module")
+def processor():
+    return GrobidProcessor(None)
+
+
+def assert_same(processor, text):
+    coordinates, pages = processor.parse_tei(text)
+    assert coordinates == processor.get_coordinates(text)
+    assert pages == processor.get_pages(text)
+
+
+def test_sample_tei(processor):
+    # the recorded TEI, or the synthetic one when GROBID was not available
+    assert_same(processor, load_tei(SAMPLE_TEI))
+
+
+@pytest.mark.parametrize("indent", [True, False])
+def test_synthetic_tei(processor, indent):
+    assert_same(processor, synthetic_tei(indent=indent))
+
+
+def random_element(rng, depth):
+    name = rng.choice(("p", "s", "ref", "biblStruct", "persName", "title"))
+    coords = ""
+    if rng.random() < 0.5:
+        coords = f' coords="{rng.randint(1, 3)},1.0,2.0,3.0,4.0"'
+    parts = [rng.choice(WHITESPACES)]
+    if depth < 4:
+        for _ in range(rng.randint(0, 3)):
+            parts.append(random_element(rng, depth + 1))
+            parts.append(rng.choice(WHITESPACES + ("text", " a b ")))
+    return f"<{name}{coords}>{''.join(parts)}</{name}>"
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_whitespace(processor, seed):
+    rng = random.Random(seed)
+    body = "".join(random_element(rng, 0) for _ in range(5))
+    text = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0">\n\t<facsimile>\n\t\t'
+        '<surface n="1" ulx="0.0" uly="0.0" lrx="612.0" lry="792.0"/>\n\t'
+        f"</facsimile>\n\t<text>{body}</text>\n</TEI>"
+    )
+    assert_same(processor, text)